@@ -1,21 +1,129 @@
+import os
 import cv2
 import random
-import warnings
 import pyclipper
 import numpy as np
 from tqdm import tqdm
 import os.path as osp
 from PIL import Image
-from p_tqdm import p_map
-from ibasis.idtbs import DataDir
+from concurrent.futures import ProcessPoolExecutor
+from ibasis.idtbs import DataDirDT
 from ibasis import ibasisF as base
-from ibasis import (ipath, icolor, ipoint, imgalg)
+from ibasis import (ipath, icolor, ipoint, imgalg, iimg, imultiproc, ifile)
 
 from busi import utils as bu
 from busi import (fio, parser, idraw)
 
 
-class ImageDataset(DataDir):
+# === 掩码生成 ===
+def _fill_polys(msk, polys, value=1):
+    """一次fillPoly填充全部多边形
+    fillPoly对多个多边形的重叠区域按奇偶规则填充(会被挖空), 外接框有重叠时退回逐个填充
+    """
+    if len(polys) == 0:
+        return msk
+    rects = np.array([cv2.boundingRect(pts) for pts in polys])
+    x1, y1 = rects[:, 0], rects[:, 1]
+    x2, y2 = x1 + rects[:, 2], y1 + rects[:, 3]
+    is_overlap = ((x1[:, None] < x2[None]) & (x1[None] < x2[:, None])
+                  & (y1[:, None] < y2[None]) & (y1[None] < y2[:, None]))
+    np.fill_diagonal(is_overlap, False)
+    if is_overlap.any():
+        for pts in polys:
+            cv2.fillPoly(msk, [pts], value)
+    else:
+        cv2.fillPoly(msk, polys, value)
+    return msk
+
+
+def _gen_msk_worker(arg):
+    """生成单张掩码, 需为模块级函数以便进程池pickle
+    Args:
+        arg: (img_path, lbl_path, out_path, hw, is_force)
+            hw: 图片 (H, W), 一般来自图片头信息索引, None 时读取文件头
+    Returns:
+        状态 'done'/'skip'/'fail'
+    """
+    img_path, lbl_path, out_path, hw, is_force = arg
+    try:
+        # 标注文件不比掩码新时跳过
+        if not is_force and osp.exists(out_path) and \
+                os.stat(lbl_path).st_mtime_ns <= os.stat(out_path).st_mtime_ns:
+            return 'skip'
+        if hw is None:
+            hw = iimg.get_img_size(img_path)
+            if hw is None:
+                raise ValueError('无法读取图片尺寸')
+        lbl_dic = fio.read_neolix_ocr_label(lbl_path, is_icdar_fmt=True)
+        msk = _fill_polys(np.zeros(hw, dtype=np.uint8), [np.array(pts, dtype=np.int32) for pts in lbl_dic])
+        msk = Image.fromarray(msk)
+        msk.putpalette(icolor.palette)
+        ipath.make_path_dir(out_path)
+        # 先写临时文件再替换, 中断时不会留下残缺的掩码被下次跳过
+        tmp_path = f"{out_path}.{os.getpid()}.tmp.png"
+        msk.save(tmp_path)
+        os.replace(tmp_path, out_path)
+        return 'done'
+    except Exception as e:
+        print('Gen mask failed!', img_path, e)
+        return 'fail'
+
+
+# === 标注可视化 ===
+def _draw_lbl(img, lbl_dic, reduce=1):
+    """在内存中把标注画到图片上, reduce>1 时图片已缩小reduce倍, 多边形同比缩放"""
+    if reduce > 1:
+        lbl_dic = {tuple((int(x / reduce), int(y / reduce)) for x, y in pts): attr for pts, attr in lbl_dic.items()}
+    return idraw.draw_polygon(img, lbl_dic, draw_info_keys=['txt'], is_disp_key=True)
+
+
+def _fit_thumb(img, thumb_size):
+    """等比缩放后居中贴到 thumb_size=(W, H) 的黑底上"""
+    tw, th = thumb_size
+    h, w = img.shape[:2]
+    ratio = min(tw / w, th / h)
+    nw, nh = max(int(w * ratio), 1), max(int(h * ratio), 1)
+    thumb = np.zeros((th, tw, 3), dtype=np.uint8)
+    x, y = (tw - nw) // 2, (th - nh) // 2
+    thumb[y:y+nh, x:x+nw] = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_AREA)
+    return thumb
+
+
+def _vis_worker(arg):
+    """渲染单张可视化图, 需为模块级函数以便进程池pickle
+    Args:
+        arg: (img_path, lbl_path, out_path, thumb_size, quality)
+            thumb_size: None 为原图尺寸, 否则缩放到(W, H), JPEG在解码阶段直接缩小
+            out_path: 不为None时写为JPEG, 否则返回渲染结果(用于拼图)
+    Returns:
+        (img, err): out_path为None时img为渲染结果, 否则为None; 成功时err为None, 失败时为错误信息
+    """
+    img_path, lbl_path, out_path, thumb_size, quality = arg
+    try:
+        reduce = 1
+        if thumb_size is not None:
+            hw = iimg.get_img_size(img_path)
+            while hw is not None and reduce < 8 and \
+                    hw[0] // (reduce * 2) >= thumb_size[1] and hw[1] // (reduce * 2) >= thumb_size[0]:
+                reduce *= 2
+        with open(img_path, 'rb') as f:
+            img = iimg.decode_img(f.read(), reduce=reduce)
+        if img is None:
+            raise ValueError('图片解码失败')
+        img = _draw_lbl(img, fio.read_neolix_ocr_label(lbl_path, is_icdar_fmt=True), reduce)
+        if thumb_size is not None:
+            img = _fit_thumb(img, thumb_size)
+        if out_path is None:
+            return img, None
+        ipath.make_path_dir(out_path)
+        if not cv2.imwrite(out_path, img, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+            raise IOError(f'写入失败: {out_path}')
+    except Exception as e:
+        return None, str(e)
+    return None, None
+
+
+class ImageDataset(DataDirDT):
     def __init__(self, 
                 pdir=None, 
                 img_dir=None, 
@@ -29,80 +137,109 @@ class ImageDataset(DataDir):
                 lbl_file_type='.json',
                 img_stem_append=None,
                 lbl_stem_append=None,
+                cache_dir=None,
+                backend='dict',
                 ):
         super(ImageDataset, self).__init__(pdir, 
                                 img_dir,
                                 lbl_dir, 
                                 msk_dir, 
                                 list_dir, 
-                                vis_dir, 
-                                show_list_dir)
+                                vis_dir,
+                                img_key_mode=key_mode,
+                                lbl_key_mode=key_mode,
+                                img_file_type=img_file_type,
+                                lbl_file_type=lbl_file_type,
+                                img_stem_append=img_stem_append,
+                                lbl_stem_append=lbl_stem_append,
+                                cache_dir=cache_dir,
+                                backend=backend)
+        self.show_list_dir = show_list_dir
         self.key_mode = key_mode
-        self.img_file_type = img_file_type
-        self.lbl_file_type = lbl_file_type
-        self.key_mode = key_mode
-        self.img_stem_append = img_stem_append
-        self.lbl_stem_append = lbl_stem_append
-
-    def init_bef_call_methods(self):
-        self.img_path_dic = ipath.get_paths(self.img_dir, file_type=self.img_file_type, key_mode=self.key_mode, stem_append=self.img_stem_append)
-        self.lbl_path_dic = ipath.get_paths(self.lbl_dir, file_type=self.lbl_file_type, key_mode=self.key_mode, stem_append=self.lbl_stem_append)
-        self.inter_keys = sorted(list(base.get_intersection_keys(self.img_path_dic, self.lbl_path_dic)))
-        self.img_num = len(self.img_path_dic)
-        self.lbl_num = len(self.lbl_path_dic)
-        self.inter_num = len(self.inter_keys)
-        print(f"Image num:{self.img_num}, Label num:{self.lbl_num}, Inter num:{self.inter_num}")
-
-    def __iter__(self):
-        for key in self.inter_keys:
-            yield [key, self.img_path_dic.get(key), self.lbl_path_dic.get(key)]
-    
-    def __len__(self):
-        return (self.img_num, self.lbl_num, self.inter_num)
-    
-    def _is_idx_fine(self, idx):
-        if idx >= self.inter_num:
-            raise IndexError(f"Input idx({idx}) should < length ({self.inter_num})")
-
-    def get_data_pair(self, idx_or_key):
-        if isinstance(idx_or_key, int):
-            return (self.inter_keys[idx_or_key], 
-                    self.img_path_dic[self.inter_keys[idx_or_key]], 
-                    self.lbl_path_dic[self.inter_keys[idx_or_key]])
-        elif isinstance(idx_or_key, str):
-            if idx_or_key in self.inter_keys:
-                return (idx_or_key, self.img_path_dic[idx_or_key], self.lbl_path_dic[idx_or_key])
-        else:
-            warnings.warn(f"{idx_or_key} not in inter_keys, 返回None")
-            return (None, None, None)
+
+    def _get_vis_path(self, img_path):
+        rel_path = self.rel(name='img_dir', path=img_path)
+        return osp.join(self.vis_dir, f"{osp.splitext(rel_path)[0]}.jpg")
 
     def vis_lbl_on_img(self, idx=None, dst_path=None, is_verbose=False):
         key, img_path, lbl_path = self.get_data_pair(idx)
-        res_dic = fio.read_neolix_ocr_label(lbl_path, is_icdar_fmt=True)
-        img = cv2.imread(img_path) 
-        img = idraw.draw_polygon(img, res_dic, draw_info_keys=['txt'], is_disp_key=True)
-        rel_path = self.rel(name='img_dir', path=img_path)
         if dst_path is None:
-            dst_path = osp.join(self.vis_dir, f"{osp.splitext(rel_path)[0]}.jpg")
-        ipath.make_path_dir(dst_path)
-        cv2.imwrite(dst_path, img)
+            dst_path = self._get_vis_path(img_path)
+        _, err = _vis_worker((img_path, lbl_path, dst_path, None, 95))
+        if err is not None:
+            print(f"Vis failed! {img_path}, {err}")
+            return False
         if is_verbose:
             print(f"Save vis img on:{dst_path}")
-    
+        return True
+
+    def vis_batch(self, kw=None, num_workers=None, thumb_size=None, grid=None, quality=90):
+        """在进程池中批量渲染标注, 全程在内存中完成
+        Args:
+            kw: key包含的关键词, None 为全部
+            num_workers: 进程数, None 为cpu核数
+            thumb_size: (W, H), 不为None时每张图缩小到该尺寸, JPEG在解码阶段直接缩小
+            grid: (cols, rows), 不为None时拼成联系表(contact sheet)写到 vis_dir/sheets/,
+                thumb_size 默认(320, 320), 每个格子左上角为序号, 对应关系见 vis_dir/sheets/sheets.txt
+            quality: JPEG质量
+        Returns:
+            渲染失败的 [(img_path, 错误信息)]
+        """
+        pairs = list(self.get_data_pair_with_kw(kw))
+        fail_lis = list()
+        if grid is None:
+            args_iter = ((img_path, lbl_path, self._get_vis_path(img_path), thumb_size, quality)
+                         for _, img_path, lbl_path in pairs)
+            with ProcessPoolExecutor(num_workers) as ex:
+                for i, (_, err) in enumerate(tqdm(ex.map(_vis_worker, args_iter, chunksize=16), total=len(pairs))):
+                    if err is not None:
+                        fail_lis.append((pairs[i][1], err))
+            for img_path, err in fail_lis:
+                print(f"Vis failed! {img_path}, {err}")
+            print(f"Save {len(pairs) - len(fail_lis)} vis imgs on: {self.vis_dir}, failed: {len(fail_lis)}")
+            return fail_lis
+
+        thumb_size = thumb_size or (320, 320)
+        (cols, rows), (tw, th) = grid, thumb_size
+        sheet_dir = osp.join(self.vis_dir, 'sheets')
+        os.makedirs(sheet_dir, exist_ok=True)
+        sheet = np.zeros((rows * th, cols * tw, 3), dtype=np.uint8)
+        n_sheet = 0
+        args_iter = ((img_path, lbl_path, None, thumb_size, quality) for _, img_path, lbl_path in pairs)
+        with ProcessPoolExecutor(num_workers) as ex, \
+                open(osp.join(sheet_dir, 'sheets.txt'), 'w') as f:
+            for i, (thumb, err) in enumerate(tqdm(imultiproc.imap_ordered(ex, _vis_worker, args_iter),
+                                                  total=len(pairs))):
+                if err is not None:
+                    fail_lis.append((pairs[i][1], err))
+                j = i % (cols * rows)
+                y, x = (j // cols) * th, (j % cols) * tw
+                sheet[y:y+th, x:x+tw] = 0 if thumb is None else thumb
+                cv2.putText(sheet, str(j), (x + 2, y + 14), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 255, 255), 1)
+                sheet_name = f"sheet_{n_sheet:05d}.jpg"
+                f.write(f"{sheet_name}\t{j}\t{pairs[i][0]}\n")
+                if j == cols * rows - 1 or i == len(pairs) - 1:
+                    cv2.imwrite(osp.join(sheet_dir, sheet_name), sheet, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                    sheet[:] = 0
+                    n_sheet += 1
+        for img_path, err in fail_lis:
+            print(f"Vis failed! {img_path}, {err}")
+        print(f"Save {n_sheet} contact sheets of {len(pairs)} imgs on: {sheet_dir}, failed: {len(fail_lis)}")
+        return fail_lis
+
     def get_data_pair_with_kw(self, kw=None):
-        for inter_key in self.inter_keys:
-            if kw is not None and not kw in inter_key:
+        for key, img_path, lbl_path in self.data_pair:
+            if kw is not None and not kw in key:
                 continue    
-            yield self.get_data_pair(inter_key)
+            yield (key, img_path, lbl_path)
 
-    def check_label_is_reasonable(self, kw=None):
-        i = 0
-        for idx, (stem, img_path, lbl_path) in enumerate(tqdm(self.get_data_pair_with_kw(kw))):
-            i = idx
-            img = cv2.imread(img_path)
+    def check_label_is_reasonable(self, kw=None, is_save=False):
+        """打印每个多边形的最小外接矩形信息, is_save=True 时把结果图写到vis_dir"""
+        cnt = 0
+        for stem, img_path, lbl_path in tqdm(self.get_data_pair_with_kw(kw)):
+            cnt += 1
             lbl_dic = fio.read_neolix_ocr_label(lbl_path, is_icdar_fmt=True)
-            self.vis_lbl_on_img(stem, dst_path='tmp_aopeng.png')
-            img = cv2.imread('tmp_aopeng.png')
+            img = _draw_lbl(cv2.imread(img_path), lbl_dic)
             for pts, attr_dic in lbl_dic.items():
                 x, y, w, h = cv2.boundingRect(np.array(pts))
                 # cv2.rectangle(img, (x, y), (x + w, y + h), (255, 255, 0), 2)
@@ -118,43 +255,50 @@ class ImageDataset(DataDir):
                 main_dirc = base.calc_polygon_main_direction(pts)
                 for pt, t in zip(pts, ['lt', 'rt', 'rb', 'lb']):
                     cv2.putText(img, t, pt, cv2.FONT_HERSHEY_SIMPLEX, fontScale=0.5, color=(0, 255, 0), thickness=1)
-                cv2.imwrite('tmp_aopeng.png', img)
                 print(rect_blob[1][0]/rect_blob[1][1])
                 print('-'*50)
-                pass
-        print(idx)
-
-
-    def gen_msk(self, idx=None, is_verbose=False):
-        def _gen_single(args):
-            img_path, lbl_path, out_path = args
-            try:
-                H, W = cv2.imread(img_path).shape[:2]
-                msk = np.zeros((H,W), dtype=np.uint8)
-                lbl_dic = fio.read_neolix_ocr_label(lbl_path, is_icdar_fmt=True)
-                for pts, attr in lbl_dic.items():
-                    cv2.fillPoly(msk, [np.array(pts, dtype=int)], (1))
-                msk = Image.fromarray(msk)
-                msk.putpalette(icolor.palette)
-                ipath.make_path_dir(out_path)
-                msk.save(out_path)
-                if is_verbose:
-                    print('Mask saved at:', out_path)
-            except Exception:
-                print('Gen mask failed!', img_path)
-        
+            if is_save:
+                dst_path = self._get_vis_path(img_path)
+                ipath.make_path_dir(dst_path)
+                cv2.imwrite(dst_path, img)
+        print(cnt)
+
+    def _get_msk_path(self, key, img_path):
+        if self.key_mode == 2:
+            return self.join(name='msk_dir', path=f"{key}.png")
+        rel_path = self.rel(name='img_dir', path=img_path)
+        return osp.join(self.msk_dir, f"{osp.splitext(rel_path)[0]}.png")
+
+    def gen_msk(self, idx=None, is_verbose=False, num_workers=None, chunksize=256, is_force=False,
+                meta_path='AUTO'):
+        """由多边形标注生成掩码
+        Args:
+            idx: 下标或key, None 为全部
+            num_workers: 进程数, None 为cpu核数
+            chunksize: 每次分发给子进程的任务数
+            is_force: False 时跳过标注文件不比掩码新的key
+            meta_path: 图片头信息索引(见load_img_meta), 图片尺寸从中读取并增量更新, None 时由子进程读取文件头
+        """
         if idx is not None:
             key, img_path, lbl_path = self.get_data_pair(idx)
-            if self.key_mode == 2:
-                out_path = self.join('msk_dir', f"{key}.png")
-            _gen_single([img_path, lbl_path, out_path])
+            out_path = self._get_msk_path(key, img_path)
+            state = _gen_msk_worker((img_path, lbl_path, out_path, None, is_force))
+            if is_verbose:
+                print(f"Mask {state}: {out_path}")
+            return
+
+        if meta_path is not None:
+            self.load_img_meta(index_path=meta_path)
+            hw_lis = [tuple(hw) if hw[0] > 0 else None for hw in self.get_img_sizes().tolist()]
         else:
-            args_lis = list()
-            for key, img_path, lbl_path in self.__iter__():
-                if self.key_mode == 2:
-                    out_path = self.join('msk_dir', f"{key}.png")
-                args_lis.append((img_path, lbl_path, out_path))
-            p_map(_gen_single, args_lis)
+            hw_lis = [None] * len(self.data_pair)
+        args_iter = ((img_path, lbl_path, self._get_msk_path(key, img_path), hw, is_force)
+                     for (key, img_path, lbl_path), hw in zip(self.data_pair, hw_lis))
+        cnt_dic = {'done': 0, 'skip': 0, 'fail': 0}
+        with ProcessPoolExecutor(num_workers) as ex:
+            for state in tqdm(ex.map(_gen_msk_worker, args_iter, chunksize=chunksize), total=len(self.data_pair)):
+                cnt_dic[state] += 1
+        print(f"Gen mask on {self.msk_dir}, done:{cnt_dic['done']}, skip:{cnt_dic['skip']}, fail:{cnt_dic['fail']}")
 
     def parser_lbl(self, mode):
         pass
@@ -162,24 +306,31 @@ class ImageDataset(DataDir):
     def wrap(self, func, func_kwargs):
         func(self, **func_kwargs)
 
-    def gen_list_file(self, name, num=-1, is_random=False, is_stem=False):
-        idxs = list(range(0, self.inter_num))
-        if is_random:
-            np.random.shuffle(idxs)
-        if num != -1:
-            idxs = idxs[:num]
-        _img_dir = self.img_dir
-        if not _img_dir.endswith('/'):
-            _img_dir  += '/'
-        if not osp.exists(self.list_dir):
-            self.makedirs('list_dir')
-        list_file_path = osp.join(self.list_dir, f"{name}.txt")
-        with open(list_file_path, 'w') as f:
-            for idx in idxs:
-                img_path = self.img_path_dic[self.inter_keys[idx]]
-                rel_path = img_path.replace(_img_dir, '')
-                f.write(f"{rel_path}\n")
-        print(f"Gen {name}.txt successfully on {list_file_path}")
+    def gen_list_file(self, name, num=-1, is_random=False, is_stem=False, splits=None, num_shards=1,
+                      stratify_depth=None, seed=None, is_offsets=False):
+        """生成图片相对路径的列表文件, 见ifile.gen_list_files
+        Args:
+            name: 列表名, splits为None时输出 {name}.txt, 否则输出 {name}_{划分名}.txt
+            num: 只取前num个, -1 为全部
+            is_random: 是否打乱
+            is_stem: True 时写入不带后缀的相对路径
+            splits: {划分名: 比例}, 如 {'train': 0.8, 'val': 0.1, 'test': 0.1}
+            num_shards: 每个划分分为num_shards片, 文件名再加 _{片号:03d}
+            stratify_depth: 按相对路径前几级目录(如供应商子目录)分层划分
+            seed: 随机种子
+            is_offsets: 同时写出行偏移文件, 可用ifile.ListFile按行号O(1)读取
+        """
+        prefix = osp.join(self.img_dir, '')
+        rel_paths = [img_path[len(prefix):] if img_path.startswith(prefix) else img_path
+                     for _, img_path, _ in self.data_pair]
+        if is_stem:
+            rel_paths = [osp.splitext(rel_path)[0] for rel_path in rel_paths]
+        splits = {name: 1} if splits is None else {f"{name}_{k}": v for k, v in splits.items()}
+        res_dic = ifile.gen_list_files(rel_paths, self.list_dir, splits=splits, num_shards=num_shards,
+                                       stratify_depth=stratify_depth, num=num, is_shuffle=is_random, seed=seed,
+                                       is_offsets=is_offsets)
+        for list_file_path, cnt in res_dic.items():
+            print(f"Gen {osp.basename(list_file_path)}({cnt}) successfully on {list_file_path}")
 
 
 class OCR_dataset(ImageDataset):
@@ -196,6 +347,8 @@ class OCR_dataset(ImageDataset):
                 lbl_file_type='.json',
                 img_stem_append=None,
                 lbl_stem_append=None,
+                cache_dir=None,
+                backend='dict',
                 ):
          super(OCR_dataset, self).__init__(
                 pdir=pdir, 
@@ -209,7 +362,9 @@ class OCR_dataset(ImageDataset):
                 img_file_type=img_file_type,
                 lbl_file_type=lbl_file_type,
                 img_stem_append=img_stem_append,
-                lbl_stem_append=lbl_stem_append
+                lbl_stem_append=lbl_stem_append,
+                cache_dir=cache_dir,
+                backend=backend,
          )
          pass
 
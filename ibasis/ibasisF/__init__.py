@@ -1,11 +1,13 @@
 from .iaffine import *
 from .ibasic import *
 from .icolor import *
+from .idedup import *
 from .idraw import *
 from .idtbs import *
 from .ifile import *
 from .iformat import *
 from .iimg import *
+from .iimgmeta import *
 from .ilmdb import *
 from .ilog import *
 from .imath import *
@@ -13,6 +15,8 @@ from .imetric import *
 from .imgalg import *
 from .imultiproc import *
 from .ipath import *
+from .ipathcache import *
+from .ipathtable import *
 from .ipoint import *
 from .iprofile import *
 from .iserialization import *
@@ -0,0 +1 @@
+../../ibasis/idedup.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../ibasis/iimgmeta.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../ibasis/ipathcache.py
\ No newline at end of file
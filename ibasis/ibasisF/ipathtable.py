@@ -0,0 +1 @@
+../../ibasis/ipathtable.py
\ No newline at end of file
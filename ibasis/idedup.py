@@ -0,0 +1,161 @@
+import os
+import hashlib
+import os.path as osp
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import ipath, iserialization
+
+try:
+    import xxhash
+
+    HASH_ALGO = 'xxh3_64'
+
+    def _new_hasher():
+        return xxhash.xxh3_64()
+except ImportError:
+    # 没有安装xxhash时退回blake2b, 速度稍慢
+    HASH_ALGO = 'blake2b_64'
+
+    def _new_hasher():
+        return hashlib.blake2b(digest_size=8)
+
+
+# 按内容查找重复文件
+# 依次按 文件大小 -> 头尾部分hash -> 全文hash 缩小候选范围, hash按 (dev, inode, mtime, size) 缓存
+# 缓存同时记录hash算法与partial_size, 不一致时(如安装xxhash前后)整体失效
+
+DEDUP_CACHE_DIR = osp.join(osp.expanduser('~'), '.cache', 'ibasis', 'dedup')
+
+
+def _stat_file(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path, None
+    return path, (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _hash_file(path, size, partial_size=None, chunk_size=1 << 20):
+    """partial_size 不为None时只hash头尾各partial_size字节"""
+    hasher = _new_hasher()
+    with open(path, 'rb') as f:
+        if partial_size is not None and size > 2 * partial_size:
+            hasher.update(f.read(partial_size))
+            f.seek(size - partial_size)
+            hasher.update(f.read(partial_size))
+        else:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class DedupIndex:
+    def __init__(self, dir_, file_type='IMAGE', num_workers=8, partial_size=1 << 16, cache_path='AUTO'):
+        """
+        Args:
+            dir_: 目录
+            file_type: 同ipath.get_paths
+            num_workers: stat/hash 的线程数
+            partial_size: 部分hash时头尾各读取的字节数
+            cache_path: hash缓存文件, 'AUTO' 为 ~/.cache/ibasis/dedup/ 下按目录与hash算法命名, None 不缓存
+        """
+        self.dir_ = dir_
+        self.file_type = file_type
+        self.num_workers = num_workers
+        self.partial_size = partial_size
+        if cache_path == 'AUTO':
+            name = hashlib.md5(osp.abspath(dir_).encode('utf-8', 'surrogateescape')).hexdigest()
+            cache_path = osp.join(DEDUP_CACHE_DIR, f"{name}_{HASH_ALGO}.pkl")
+        self.cache_path = cache_path
+        self._cache = dict()        # {(dev, inode, mtime_ns, size): {'partial': h, 'full': h}}
+        self.groups = list()
+
+    def _load_cache(self):
+        if self.cache_path is None or not osp.exists(self.cache_path):
+            return
+        data = iserialization.load_pkl(self.cache_path)
+        # 旧格式(无算法信息)或算法/partial_size不同的缓存直接丢弃
+        if isinstance(data, dict) and data.get('algo') == HASH_ALGO and data.get('partial_size') == self.partial_size:
+            self._cache = data['hashes']
+
+    def _save_cache(self, file_keys):
+        if self.cache_path is None:
+            return
+        # 只保留本次仍存在的文件, 避免缓存无限增长
+        cache = {k: self._cache[k] for k in file_keys if k in self._cache}
+        ipath.make_path_dir(self.cache_path)
+        iserialization.dump_pkl(self.cache_path, {'algo': HASH_ALGO, 'partial_size': self.partial_size,
+                                                  'hashes': cache})
+
+    def _get_hash(self, ex, units, mode):
+        """units: [(file_key, paths)], 返回与之对应的hash列表, 优先读取缓存"""
+        hashes = [self._cache.get(file_key, {}).get(mode) for file_key, _ in units]
+        todo = [i for i, h in enumerate(hashes) if h is None]
+        partial_size = self.partial_size if mode == 'partial' else None
+        res = ex.map(lambda i: _hash_file(units[i][1][0], units[i][0][3], partial_size), todo)
+        for i, h in zip(todo, res):
+            hashes[i] = h
+            self._cache.setdefault(units[i][0], {})[mode] = h
+        return hashes
+
+    def _split_groups(self, ex, groups, mode):
+        """将每组units按hash细分, 只保留仍有重复的组"""
+        units = [u for g in groups for u in g]
+        hashes = iter(self._get_hash(ex, units, mode))
+        new_groups = list()
+        for group in groups:
+            sub_dic = defaultdict(list)
+            for unit in group:
+                sub_dic[next(hashes)].append(unit)
+            new_groups.extend(g for g in sub_dic.values() if len(g) > 1)
+        return new_groups
+
+    def build(self):
+        """扫描目录并得到重复文件分组, 每组内按路径排序"""
+        self._load_cache()
+        paths = [path for _, path in ipath.iter_paths(self.dir_, file_type=self.file_type, key_mode=3,
+                                                      dup_mode=None)]
+        with ThreadPoolExecutor(self.num_workers) as ex:
+            file_infos = [(p, k) for p, k in ex.map(_stat_file, paths) if k is not None]
+            # 同一inode(硬链接)的文件内容必然相同, 合并为一个unit只hash一次
+            inode_dic = dict()
+            for path, file_key in file_infos:
+                inode_dic.setdefault(file_key[:2], (file_key, []))[1].append(path)
+            # 1. 按大小分组
+            size_dic = defaultdict(list)
+            for unit in inode_dic.values():
+                size_dic[unit[0][3]].append(unit)
+            groups = [g for g in size_dic.values() if len(g) > 1]
+            # 2. 头尾部分hash; 3. 全文hash, 文件不大于2*partial_size时部分hash即为全文
+            groups = self._split_groups(ex, groups, 'partial')
+            small_groups = [g for g in groups if g[0][0][3] <= 2 * self.partial_size]
+            groups = [g for g in groups if g[0][0][3] > 2 * self.partial_size]
+            groups = small_groups + self._split_groups(ex, groups, 'full')
+        self._save_cache([k for k, _ in inode_dic.values()])
+        # 内容组之外, 仅由硬链接构成的inode同样是重复
+        grouped = set(file_key for g in groups for file_key, _ in g)
+        groups += [[unit] for unit in inode_dic.values() if len(unit[1]) > 1 and unit[0] not in grouped]
+        self.groups = sorted(sorted(p for _, paths in g for p in paths) for g in groups)
+        return self
+
+    def get_dup_paths(self, keep='first'):
+        """返回需要剔除的重复文件路径集合, 每组保留一个
+        Args:
+            keep: 'first' 保留每组路径排序后的第一个, 'last' 保留最后一个
+        """
+        dup_set = set()
+        for group in self.groups:
+            dup_set.update(group[1:] if keep == 'first' else group[:-1])
+        return dup_set
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __iter__(self):
+        return iter(self.groups)
+
+
+def find_dup_files(dir_, file_type='IMAGE', num_workers=8, cache_path='AUTO'):
+    """返回重复文件分组 [[path1, path2, ...], ...]"""
+    return DedupIndex(dir_, file_type=file_type, num_workers=num_workers, cache_path=cache_path).build().groups
@@ -1,9 +1,11 @@
 import os
+import numpy as np
 import os.path as osp
 from loguru import logger
 
 from ibasis import ipath
-from ibasis import ibasic
+from ibasis import ipathtable
+from ibasis import iimgmeta
 
 
 class DataDir:
@@ -179,7 +181,16 @@ class DataDirDT(DataDir):
                  lbl_file_type='.json',
                  img_stem_append=None,
                  lbl_stem_append=None,
+                 cache_dir=None,
+                 backend='dict',
                  ):
+        """
+        Args:
+            cache_dir: 路径索引缓存目录, None 则每次全量扫描, 见ipath.get_paths
+            backend: img_path_dic/lbl_path_dic 的存储方式
+                'dict': get_paths返回的字典
+                'table': ipathtable.PathTable, 千万级文件时内存占用约为字典的1/10
+        """
         super(DataDirDT, self).__init__(pdir,
                                         img_dir,
                                         lbl_dir,
@@ -193,40 +204,117 @@ class DataDirDT(DataDir):
         self.lbl_key_mode = lbl_key_mode
         self.img_stem_append = img_stem_append
         self.lbl_stem_append = lbl_stem_append
+        self.cache_dir = cache_dir
+        self.backend = backend
+        self.img_num, self.lbl_num, self.inter_num = 0, 0, 0
+
+    def _get_paths(self, dir_, file_type, key_mode, stem_append):
+        if self.backend == 'dict':
+            return ipath.get_paths(dir_, file_type=file_type, key_mode=key_mode,
+                                   stem_append=stem_append, cache_dir=self.cache_dir)
+        elif self.backend == 'table':
+            return ipathtable.PathTable.from_dir(dir_, file_type=file_type, key_mode=key_mode,
+                                                 stem_append=stem_append, cache_dir=self.cache_dir)
+        else:
+            raise NotImplementedError(f"backend 类型有误, 期望['dict', 'table'], 输入:{self.backend}")
 
     def init_bef_call_methods(self):
-        self.img_path_dic = ipath.get_paths(self.img_dir, file_type=self.img_file_type, 
-                                            key_mode=self.key_mode, stem_append=self.img_stem_append)
-        self.lbl_path_dic = ipath.get_paths(self.lbl_dir, file_type=self.lbl_file_type, 
-                                            key_mode=self.key_mode, stem_append=self.lbl_stem_append)
-        self.inter_keys = sorted(list(ibasic.get_intersection_keys(self.img_path_dic, self.lbl_path_dic)))
+        self.img_path_dic = self._get_paths(self.img_dir, self.img_file_type, self.img_key_mode, self.img_stem_append)
+        self.lbl_path_dic = self._get_paths(self.lbl_dir, self.lbl_file_type, self.lbl_key_mode, self.lbl_stem_append)
+        self.data_pair = ipathtable.pair_tables(self.img_path_dic, self.lbl_path_dic)
         self.img_num = len(self.img_path_dic)
         self.lbl_num = len(self.lbl_path_dic)
-        self.inter_num = len(self.inter_keys)
+        self.inter_num = len(self.data_pair)
         logger.info(f"Image num:{self.img_num}, Label num:{self.lbl_num}, Inter num:{self.inter_num}")
 
+    def get_inter_keys(self):
+        """有序的配对key列表, 每次调用都会新建列表(O(N)), 按下标/key访问请用data_pair或index"""
+        return self.data_pair.keys()
+
+    def get_unpaired_keys(self):
+        """返回 (只有图片的key, 只有标注的key), 用于数据质检"""
+        return self.data_pair.only_img_keys(), self.data_pair.only_lbl_keys()
+
+    def __getstate__(self):
+        # 配对信息都在data_pair中, 不再携带两份路径字典, 传给DataLoader workers时无需重新扫描目录
+        state = self.__dict__.copy()
+        state.pop('img_path_dic', None)
+        state.pop('lbl_path_dic', None)
+        return state
+
     def __iter__(self):
-        for key in self.inter_keys:
-            yield [key, self.img_path_dic.get(key), self.lbl_path_dic.get(key)]
+        for key, img_path, lbl_path in self.data_pair:
+            yield [key, img_path, lbl_path]
 
     def __len__(self):
+        """配对数, 可直接作为map-style dataset使用"""
+        return self.inter_num
+
+    def __bool__(self):
+        # 目录配置对象本身恒为真, 不随配对数变化
+        return True
+
+    def get_nums(self):
         return (self.img_num, self.lbl_num, self.inter_num)
 
+    def index(self, key, default=-1):
+        """key -> 配对下标, O(1)"""
+        return self.data_pair.index(key, default)
+
+    def __getitem__(self, idx_or_key):
+        """idx/key -> (key, img_path, lbl_path), 子类可重写为读取图片与标注"""
+        if isinstance(idx_or_key, str):
+            idx = self.index(idx_or_key)
+            if idx < 0:
+                raise KeyError(idx_or_key)
+            return self.data_pair[idx]
+        return self.data_pair[idx_or_key]
+
+    def load_img_meta(self, index_path='AUTO', num_workers=16, is_update=True):
+        """加载img_dir的图片头信息索引(见iimgmeta.ImgMetaIndex), 并按data_pair下标对齐
+        Args:
+            index_path: 见iimgmeta.ImgMetaIndex, 'AUTO' 时保存在 iimgmeta.IMG_META_CACHE_DIR
+            is_update: True 时增量更新索引(只读取有变化文件的文件头), False 时直接读取已有索引
+        Attributes:
+            img_meta: ImgMetaIndex
+            img_meta_idx: 第i个配对在img_meta中的下标, 不在索引中为-1
+        """
+        self.img_meta = iimgmeta.ImgMetaIndex(self.img_dir, file_type=self.img_file_type, num_workers=num_workers,
+                                              index_path=index_path)
+        if is_update or self.img_meta.index_path is None or not osp.exists(self.img_meta.index_path):
+            self.img_meta.build()
+        else:
+            self.img_meta.load()
+        self.img_meta_idx = self.img_meta.index_many([img_path for _, img_path, _ in self.data_pair])
+        return self.img_meta
+
+    def get_img_meta(self, idx):
+        """配对下标 -> 图片头信息dict, 需先调用load_img_meta"""
+        meta_idx = int(self.img_meta_idx[idx])
+        return None if meta_idx < 0 else self.img_meta.get_meta(meta_idx)
+
+    def get_img_sizes(self):
+        """与data_pair下标对齐的 (N, 2) 数组, 每行为 (H, W), 不在索引中或无法识别为(0, 0)"""
+        if len(self.img_meta) == 0:
+            return np.zeros((len(self.img_meta_idx), 2), dtype=np.int32)
+        is_found = self.img_meta_idx >= 0
+        meta_idx = np.where(is_found, self.img_meta_idx, 0)
+        sizes = np.stack([self.img_meta.height[meta_idx], self.img_meta.width[meta_idx]], axis=1)
+        sizes[~is_found] = 0
+        return sizes
+
     def _is_idx_fine(self, idx):
         if idx >= self.inter_num:
             raise IndexError(f"Input idx({idx}) should < length ({self.inter_num})")
 
     def get_data_pair(self, idx_or_key):
-        if isinstance(idx_or_key, int):
-            return (self.inter_keys[idx_or_key], 
-                    self.img_path_dic[self.inter_keys[idx_or_key]], 
-                    self.lbl_path_dic[self.inter_keys[idx_or_key]])
-        elif isinstance(idx_or_key, str):
-            if idx_or_key in self.inter_keys:
-                return (idx_or_key, self.img_path_dic[idx_or_key], self.lbl_path_dic[idx_or_key])
-        else:
-            logger.warning(f"{idx_or_key} not in inter_keys, 返回None")
-            return (None, None, None)
+        if isinstance(idx_or_key, str):
+            idx = self.index(idx_or_key)
+            if idx < 0:
+                logger.warning(f"{idx_or_key} not in inter_keys, 返回None")
+                return (None, None, None)
+            return self.data_pair[idx]
+        return self.data_pair[idx_or_key]
 
 
 class TestUnit():
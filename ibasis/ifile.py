@@ -1,32 +1,309 @@
 import os
+import time
+import errno
 import shutil
+import threading
+import numpy as np
 import os.path as osp
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from . import ipath
 
 
-def migrate(dir_, out_dir, kw=None, mode='cp'):
+# 零拷贝失败时可以回退到下一种方式的错误, 如跨文件系统/内核或文件系统不支持
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def _copy_fd(fd_in, fd_out, size):
+    """依次尝试 copy_file_range -> sendfile -> 普通读写, 只有在一个字节都没写时才回退"""
+    if hasattr(os, 'copy_file_range'):
+        offset = 0
+        try:
+            while offset < size:
+                n = os.copy_file_range(fd_in, fd_out, size - offset)
+                if n == 0:
+                    break
+                offset += n
+            return
+        except OSError as e:
+            if offset > 0 or e.errno not in _FALLBACK_ERRNOS:
+                raise
+    if hasattr(os, 'sendfile'):
+        offset = 0
+        try:
+            while offset < size:
+                n = os.sendfile(fd_out, fd_in, offset, size - offset)
+                if n == 0:
+                    break
+                offset += n
+            return
+        except OSError as e:
+            if offset > 0 or e.errno not in _FALLBACK_ERRNOS:
+                raise
+    with os.fdopen(os.dup(fd_in), 'rb') as fsrc, os.fdopen(os.dup(fd_out), 'wb') as fdst:
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def copy_file(src, dst):
+    """等价于shutil.copy(复制内容和权限位), 优先使用内核零拷贝, 返回复制的字节数"""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        _copy_fd(fsrc.fileno(), fdst.fileno(), size)
+    shutil.copymode(src, dst)
+    return size
+
+
+def _migrate_file(src, dst, mode='cp', is_link=False):
+    """迁移单个文件, 返回复制的字节数(rename/link 为0)
+    mv: 同一文件系统直接os.rename, 跨文件系统(EXDEV)时复制后删除
+    cp: is_link=True 且在同一文件系统时使用硬链接, 否则零拷贝复制
+    """
+    if mode == 'mv':
+        try:
+            os.rename(src, dst)
+            return 0
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        size = copy_file(src, dst)
+        os.remove(src)
+        return size
+    if mode == 'cp':
+        if is_link:
+            try:
+                if osp.lexists(dst):
+                    os.remove(dst)
+                os.link(src, dst)
+                return 0
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        return copy_file(src, dst)
+    raise NotImplementedError(f"mode 类型有误, 期望['cp', 'mv'], 输入:{mode}")
+
+
+def _migrate_task(src, dst, mode, is_link, done_set):
+    """返回 (日志条目, 复制的字节数), 日志中已有相同 (路径, 大小, mtime) 的条目时跳过, 字节数为None"""
+    st = os.stat(src)
+    entry = f"{src}\t{st.st_size}\t{st.st_mtime_ns}"
+    if entry in done_set:
+        return entry, None
+    return entry, _migrate_file(src, dst, mode, is_link)
+
+
+def _load_journal(journal_path):
+    if journal_path is None or not osp.exists(journal_path):
+        return set()
+    with open(journal_path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+        return set(line.rstrip('\n') for line in f)
+
+
+def migrate(dir_, out_dir, kw=None, mode='cp', num_workers=8, is_link=False, journal_path='AUTO',
+            report_interval=10, exclude=None):
     """将目录中含有关键词的文件复制/拷贝到指定文件夹
     Args:
         dir_: 目录
         out_dir: 输出路径
-        kw: 包含的关键词
+        kw: 包含的关键词, None 为全部
         mode: 'cp' or 'mv'
+        num_workers: 并行迁移的线程数
+        is_link: 'cp' 时在同一文件系统下使用硬链接代替复制
+            注意硬链接与源文件共享数据, 之后原地修改任一文件都会影响另一个
+        journal_path: 记录已完成文件的日志, 中断后重新运行会跳过 (路径, 大小, mtime) 均未变化的已完成文件
+            全部成功完成后删除日志, 之后再迁移到同一out_dir时重新处理全部文件
+            'AUTO': out_dir/.migrate.journal, None: 不记录
+        report_interval: 输出吞吐量的间隔(秒)
+        exclude: 跳过的路径集合, 如 idedup.DedupIndex(dir_).build().get_dup_paths() 得到的重复文件
+            路径需与本函数扫描dir_得到的路径形式一致(使用同一个dir_)
+    Note:
+        同名文件(key_mode=1)只迁移遍历到的第一个, 其余告警并跳过;
+        旧版本基于get_paths, 保留的是最后一个
+    Returns:
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if journal_path == 'AUTO':
+        journal_path = osp.join(out_dir, '.migrate.journal')
+    done_set = _load_journal(journal_path)
+    if len(done_set) > 0:
+        print(f"从日志恢复, 已完成: {len(done_set)}, {journal_path}")
+    journal = open(journal_path, 'a', encoding='utf-8', errors='surrogateescape') if journal_path else None
+
+    cnt, total, n_skip, n_fail, n_bytes = 0, 0, 0, 0, 0
+    st = last_report = time.time()
+
+    def _report(is_final=False):
+        used = max(time.time() - st, 1e-9)
+        print(f"{'迁移完成' if is_final else '迁移中'}: {cnt} files, {cnt/used:.1f} files/s, "
+              f"{n_bytes/used/2**20:.1f} MB/s, skip:{n_skip}, failed:{n_fail}, used:{used:.1f}s")
+
+    def _collect(futures):
+        nonlocal cnt, n_skip, n_fail, n_bytes
+        for fut in futures:
+            src = pending.pop(fut)
+            try:
+                entry, size = fut.result()
+                if size is None:
+                    n_skip += 1
+                    continue
+                n_bytes += size
+                cnt += 1
+                if journal is not None:
+                    journal.write(f"{entry}\n")
+            except Exception as e:
+                n_fail += 1
+                print(f"迁移失败: {src}, {e}")
+
+    pending = dict()
+    ex = ThreadPoolExecutor(num_workers)
+    try:
+        # 边扫描边迁移, 同名文件只迁移第一个
+        for key, path in ipath.iter_paths(dir_, file_type='IMAGE', key_mode=1, dup_mode='skip'):
+            total += 1
+            if kw is not None and kw not in path:
+                continue
+            if exclude is not None and path in exclude:
+                n_skip += 1
+                continue
+            pending[ex.submit(_migrate_task, path, osp.join(out_dir, key), mode, is_link, done_set)] = path
+            if len(pending) >= num_workers * 4:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(done)
+            if time.time() - last_report > report_interval:
+                last_report = time.time()
+                if journal is not None:
+                    journal.flush()
+                _report()
+        _collect(list(pending))
+    finally:
+        ex.shutdown(wait=True)
+        if journal is not None:
+            journal.close()
+    if journal_path is not None and n_fail == 0 and osp.exists(journal_path):
+        os.remove(journal_path)
+    _report(is_final=True)
+    print(f"迁移{cnt}/{total}")
+
+
+# === 列表文件 ===
+def _get_strata(lines, depth):
+    """按相对路径所在目录的前depth级分层, 返回每行的层编号"""
+    prefixes = ['/'.join(osp.dirname(line).split('/')[:depth]) for line in lines]
+    return np.unique(prefixes, return_inverse=True)[1]
+
+
+def _split_idxs(n, ratios, strata=None, rng=None):
+    """打乱后按比例划分, strata不为None时在每层内按比例划分
     Returns:
+        [每个划分的下标数组], 每个数组内为打乱后的顺序
     """
-    path_dic = ipath.get_paths(dir_, file_type='IMAGE', key_mode=1)
-    cnt = 0
-    for key, path in tqdm(path_dic.items()):
-        if kw in path:
-            dst_path = osp.join(out_dir, key)
-            if mode == 'mv':
-                shutil.move(path, dst_path)
-            if mode == 'cp':
-                shutil.copy(path, dst_path)
-            print(mode, path, '->', dst_path)
-            cnt += 1
-    print(f"迁移{cnt}/{len(path_dic)}")
+    perm = rng.permutation(n) if rng is not None else np.arange(n)
+    cum = np.cumsum(ratios) / np.sum(ratios)
+    codes = np.zeros(n, dtype=np.int64) if strata is None else np.asarray(strata)[perm]
+    # 每个元素在其所在层内(按打乱后顺序)的名次
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n) - starts[codes[order]]
+    bounds = np.rint(counts[:, None] * cum[None, :-1]).astype(np.int64)
+    split_ids = (rank[:, None] >= bounds[codes]).sum(axis=1)
+    return [perm[split_ids == i] for i in range(len(ratios))]
+
+
+def _write_lines(path, lines, idxs, offsets_path=None, chunk_size=65536):
+    """按下标批量写入, offsets_path 不为None时写出每行起始偏移(uint64, 共len+1个)"""
+    offsets = [np.zeros(1, dtype=np.uint64)] if offsets_path is not None else None
+    pos = 0
+    with open(path, 'wb') as f:
+        for st in range(0, len(idxs), chunk_size):
+            chunk = [lines[i].encode('utf-8', 'surrogateescape') + b'\n' for i in idxs[st:st+chunk_size].tolist()]
+            f.write(b''.join(chunk))
+            if offsets is not None:
+                offsets.append(pos + np.cumsum([len(b) for b in chunk], dtype=np.uint64))
+                pos += int(offsets[-1][-1])
+    if offsets is not None:
+        np.concatenate(offsets).tofile(offsets_path)
+
+
+def gen_list_files(lines, out_dir, splits=None, num_shards=1, stratify_depth=None, num=-1, is_shuffle=True,
+                   seed=None, is_offsets=False):
+    """一次完成 划分 + 分片 + 写出 的列表文件生成
+    Args:
+        lines: 每行内容(一般为相对路径)
+        out_dir: 输出目录
+        splits: {名称: 比例}, 如 {'train': 0.8, 'val': 0.1, 'test': 0.1}, None 为 {'all': 1}
+        num_shards: 每个划分再轮询分为num_shards片, 文件名为 {名称}_{片号:03d}.txt
+        stratify_depth: 按相对路径前几级目录(如供应商子目录)分层, 每层内按比例划分, None 不分层
+        num: 打乱后只取前num行, -1 为全部
+        is_shuffle: 是否打乱, 为False时按lines顺序划分
+        seed: 随机种子, 相同种子与输入得到相同结果
+        is_offsets: 同时写出 {文件名}.offsets, 见ListFile, 可O(1)读取第i行
+    Returns:
+        {列表文件路径: 行数}
+    """
+    if splits is None:
+        splits = {'all': 1}
+    n = len(lines)
+    rng = np.random.default_rng(seed) if is_shuffle else None
+    if num != -1 and num < n:
+        idxs = rng.permutation(n)[:num] if rng is not None else np.arange(num)
+        lines = [lines[i] for i in idxs.tolist()]
+        n = num
+    strata = _get_strata(lines, stratify_depth) if stratify_depth is not None else None
+    os.makedirs(out_dir, exist_ok=True)
+    res_dic = dict()
+    for name, split_idxs in zip(splits, _split_idxs(n, list(splits.values()), strata, rng)):
+        for shard_id in range(num_shards):
+            fname = name if num_shards == 1 else f"{name}_{shard_id:03d}"
+            path = osp.join(out_dir, f"{fname}.txt")
+            shard_idxs = split_idxs[shard_id::num_shards]
+            _write_lines(path, lines, shard_idxs, f"{path}.offsets" if is_offsets else None)
+            res_dic[path] = len(shard_idxs)
+    return res_dic
+
+
+class ListFile:
+    _open_lock = threading.Lock()
+
+    def __init__(self, path, offsets_path=None):
+        """按行号随机读取列表文件, 依赖gen_list_files(is_offsets=True)写出的offsets文件
+        Args:
+            offsets_path: None 为 {path}.offsets
+        Note:
+            使用os.pread按偏移读取, 不改变文件偏移, 可在多线程及fork后的子进程中共享
+        """
+        self.path = path
+        self.offsets_path = offsets_path or f"{path}.offsets"
+        self.num = osp.getsize(self.offsets_path) // 8 - 1
+        self._fd = self._offsets = None
+
+    def __len__(self):
+        return self.num
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Input idx({idx}) should < length ({len(self)})")
+        if self._fd is None:
+            self._open()
+        st, ed = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return os.pread(self._fd, ed - st, st)[:-1].decode('utf-8', 'surrogateescape')
+
+    def _open(self):
+        with self._open_lock:
+            if self._fd is None:
+                self._offsets = np.memmap(self.offsets_path, dtype=np.uint64, mode='r')
+                self._fd = os.open(self.path, os.O_RDONLY)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_fd'] = state['_offsets'] = None
+        return state
+
+    def __del__(self):
+        if getattr(self, '_fd', None) is not None:
+            os.close(self._fd)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,14 @@
 # 检查图片完整性
 # 在传输过程中是否损坏
 
+import io
 import os
 import cv2
+import struct
+import itertools
 import numpy as np
-from p_tqdm import p_map
+from PIL import Image, ImageOps
+from p_tqdm import p_imap
 from functools import partial
 from . import ishell, ipath
 
@@ -12,6 +16,13 @@ from . import ishell, ipath
 cv2.ocl.setUseOpenCL(False)
 cv2.setNumThreads(0)
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_GRAY
+    _turbo_jpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    # 未安装PyTurboJPEG或找不到libturbojpeg时使用cv2
+    _turbo_jpeg = None
+
 
 # === 图片完整性检查 ===
 def _check_cv2(fpath):
@@ -27,7 +38,13 @@ def _check_identify(fpath):
     return True
 
 
+def _check_header(fpath):
+    return read_img_header(fpath) is not None
+
+
 def _check_img_integrity(fpath, is_del=False, mode='identify'):
+    if mode == 'header':
+        f = _check_header(fpath)
     if mode == 'cv2':
         f = _check_cv2(fpath)
     if mode == 'identify':
@@ -40,22 +57,231 @@ def _check_img_integrity(fpath, is_del=False, mode='identify'):
 
 
 def check_img_integrity(dir_, is_del=False, file_type='IMAGE', mode='identify'):
-    path_lis = ipath.get_paths(dir_, file_type=file_type, key_mode=3, is_lis=True)
-    print(f"开始扫描缺损图片目录: {dir_}, 是否删除: {is_del}, 图片数量: {len(path_lis)}")
-    if len(path_lis) == 0:
+    """mode: 'identify' / 'cv2' 完整解码; 'header' 只检查文件头能否识别, 速度快但检查不出截断的图片"""
+    # 边扫描边检查, 不等待整个目录遍历结束
+    path_iter = (path for _, path in ipath.iter_paths(dir_, file_type=file_type, key_mode=3, dup_mode=None))
+    first_path = next(path_iter, None)
+    print(f"开始扫描缺损图片目录: {dir_}, 是否删除: {is_del}")
+    if first_path is None:
         print(f"图片数量为0, 结束!")
         return
     
     # check identify package 是否存在
     if mode == 'identify':
-        res = ishell.exec_shell(f"identify {path_lis[0]}", decode_type='utf-8', is_res=True, is_verbose=True)
+        res = ishell.exec_shell(f"identify {first_path}", decode_type='utf-8', is_res=True, is_verbose=True)
         if len(res) == 0:
             raise RuntimeError('identify not be installed, plz install imagemagick to use it.')
 
     func = partial(_check_img_integrity, is_del=is_del, mode=mode)
-    res = p_map(func, path_lis, num_cpus=0.95)
+    res = list(p_imap(func, itertools.chain([first_path], path_iter), num_cpus=0.95))
     res = ~np.array(res).astype(bool)
-    print(f"损坏/总数: {sum(res)}/{len(path_lis)}")
+    print(f"损坏/总数: {sum(res)}/{len(res)}")
+
+
+# === 图片解码 ===
+_CV2_FLAGS = {
+    (1, False): cv2.IMREAD_COLOR, (2, False): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, False): cv2.IMREAD_REDUCED_COLOR_4, (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+    (1, True): cv2.IMREAD_GRAYSCALE, (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4, (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def _apply_orientation(img, orientation):
+    """按EXIF方向旋转/翻转 (H, W[, C]) 数组, 与cv2.imdecode / PIL.ImageOps.exif_transpose 一致"""
+    if orientation in (5, 6, 7, 8):
+        img = img.swapaxes(0, 1)
+    if orientation in (2, 3, 6, 7):
+        img = img[:, ::-1]
+    if orientation in (3, 4, 7, 8):
+        img = img[::-1]
+    return np.ascontiguousarray(img)
+
+
+def _decode_pil(buf, reduce=1, is_gray=False):
+    try:
+        img = Image.open(io.BytesIO(buf))
+        mode = 'L' if is_gray else 'RGB'
+        w, h = img.size
+        if reduce > 1:
+            img.draft(mode, (w // reduce, h // reduce))   # JPEG 在解码时缩小, 其他格式无效果
+        # 与cv2.imdecode一致, 按EXIF方向旋转
+        if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            w, h = h, w
+        img = ImageOps.exif_transpose(img)
+        if reduce > 1:
+            size = (w // reduce, h // reduce)
+            if img.size != size:
+                img = img.resize(size, Image.BILINEAR)
+        img = np.asarray(img.convert(mode))
+    except (IOError, ValueError, struct.error):
+        return None
+    return img if is_gray else np.ascontiguousarray(img[..., ::-1])
+
+
+def decode_img(buf, reduce=1, is_gray=False, backend='auto'):
+    """将编码后的图片(bytes/memoryview, 如lmdb buffers=True 的value)直接解码为np.ndarray, 不额外复制
+    Args:
+        buf: 图片编码数据
+        reduce: 1/2/4/8, 缩小倍数, JPEG在解码阶段直接缩小, 比解码后resize快得多
+        is_gray: True 返回灰度图, 否则返回BGR, 与cv2.imread一致
+        backend: 'auto' JPEG优先turbojpeg, 其余cv2, cv2失败时回退PIL; 'cv2' / 'turbojpeg' / 'pil'
+            各backend均按EXIF方向旋转, 与cv2.imread及get_img_size一致
+    Returns:
+        np.ndarray, 解码失败(含空数据)返回None
+    """
+    if (reduce, is_gray) not in _CV2_FLAGS:
+        raise ValueError(f"reduce 期望[1, 2, 4, 8], 输入:{reduce}")
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    if arr.size == 0:
+        return None
+    if backend == 'auto':
+        is_jpeg = arr[:2].tobytes() == b'\xff\xd8'
+        backend = 'turbojpeg' if is_jpeg and _turbo_jpeg is not None else 'cv2'
+        img = decode_img(buf, reduce, is_gray, backend)
+        return img if img is not None else _decode_pil(buf, reduce, is_gray)
+    if backend == 'cv2':
+        try:
+            return cv2.imdecode(arr, _CV2_FLAGS[(reduce, is_gray)])
+        except cv2.error:
+            return None
+    if backend == 'turbojpeg':
+        if _turbo_jpeg is None:
+            raise RuntimeError('turbojpeg not be installed, plz install PyTurboJPEG to use it.')
+        try:
+            img = _turbo_jpeg.decode(arr, pixel_format=TJPF_GRAY if is_gray else TJPF_BGR,
+                                     scaling_factor=(1, reduce) if reduce > 1 else None)
+        except OSError:
+            return None
+        # turbojpeg 不处理EXIF方向, EXIF在文件头的APP1段中, 只解析前64KB
+        try:
+            orientation, _ = _scan_jpeg(io.BytesIO(arr[:1 << 16].tobytes()))
+        except struct.error:
+            orientation = 1
+        return _apply_orientation(img, orientation) if orientation != 1 else img
+    if backend == 'pil':
+        return _decode_pil(buf, reduce, is_gray)
+    raise NotImplementedError(f"backend 类型有误, 期望['auto', 'cv2', 'turbojpeg', 'pil'], 输入:{backend}")
+
+
+# === 图片头信息 ===
+# 只读取文件头得到宽高, 不解码像素, 百万级图片时比cv2.imread快两个数量级
+# channels 为cv2.imread(IMREAD_UNCHANGED)解码后的通道数
+
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+# SOF0~SOF15, 不含 DHT(C4), JPG(C8), DAC(CC)
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _parse_png(f, head):
+    if head[12:16] != b'IHDR':
+        return None
+    w, h = struct.unpack('>II', head[16:24])
+    return 'png', w, h, _PNG_CHANNELS.get(head[25], 3)
+
+
+def _exif_orientation(data):
+    """解析APP1段中的EXIF方向(0x0112), 不存在时返回1"""
+    if data[:6] != b'Exif\x00\x00':
+        return 1
+    tiff = data[6:]
+    endian = '<' if tiff[:2] == b'II' else '>'
+    try:
+        ifd_off = struct.unpack(endian + 'I', tiff[4:8])[0]
+        n = struct.unpack(endian + 'H', tiff[ifd_off:ifd_off+2])[0]
+        for i in range(n):
+            entry = tiff[ifd_off+2+i*12:ifd_off+14+i*12]
+            if struct.unpack(endian + 'H', entry[:2])[0] == 0x0112:
+                return struct.unpack(endian + 'H', entry[8:10])[0]
+    except struct.error:
+        pass
+    return 1
+
+
+def _scan_jpeg(f):
+    """依次读取JPEG各段直到SOF, 返回 (EXIF方向, (h, w, c)), 头信息不完整时后者为None"""
+    orientation = 1
+    f.seek(2)
+    while True:
+        b = f.read(1)
+        while b == b'\xff':
+            b = f.read(1)   # 跳过填充字节
+        if len(b) == 0:
+            return orientation, None
+        marker = b[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue        # 无长度字段的marker
+        seg = f.read(2)
+        if len(seg) < 2:
+            return orientation, None
+        seg_len = struct.unpack('>H', seg)[0]
+        if marker in _JPEG_SOF:
+            data = f.read(6)
+            if len(data) < 6:
+                return orientation, None
+            return orientation, struct.unpack('>HHB', data[1:6])
+        if marker == 0xE1 and orientation == 1:
+            orientation = _exif_orientation(f.read(seg_len - 2))
+        else:
+            f.seek(seg_len - 2, 1)
+
+
+def _parse_jpeg(f, head):
+    orientation, sof = _scan_jpeg(f)
+    if sof is None:
+        return None
+    h, w, c = sof
+    # cv2.imread 会按EXIF方向旋转, 5~8 时宽高互换
+    if orientation in (5, 6, 7, 8):
+        w, h = h, w
+    return 'jpeg', w, h, c
+
+
+def _parse_bmp(f, head):
+    dib_size = struct.unpack('<I', head[14:18])[0]
+    if dib_size == 12:
+        w, h, _, bpp = struct.unpack('<HHHH', head[18:26])
+    else:
+        w, h, _, bpp = struct.unpack('<iiHH', head[18:30])
+    return 'bmp', abs(w), abs(h), 4 if bpp == 32 else 3
+
+
+_HEADER_PARSERS = [
+    (b'\x89PNG\r\n\x1a\n', _parse_png),
+    (b'\xff\xd8', _parse_jpeg),
+    (b'BM', _parse_bmp),
+]
+
+
+def read_img_header(path):
+    """读取图片头信息
+    Returns:
+        (format, width, height, channels), format 为 'png'/'jpeg'/'bmp', 其余格式用PIL读取头信息
+        无法识别时返回None
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(32)
+            for magic, parser in _HEADER_PARSERS:
+                if head.startswith(magic) and len(head) >= 30:
+                    try:
+                        res = parser(f, head)
+                    except struct.error:
+                        res = None
+                    if res is not None:
+                        return res
+                    break
+        # 其他格式或头信息损坏, 交给PIL, Image.open同样只读取文件头
+        with Image.open(path) as img:
+            return img.format.lower(), img.width, img.height, len(img.getbands())
+    except (OSError, ValueError):
+        return None
+
+
+def get_img_size(path):
+    """不解码像素得到图片 (H, W), 与 cv2.imread(path).shape[:2] 一致, 无法识别时返回None"""
+    res = read_img_header(path)
+    return None if res is None else (res[2], res[1])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,191 @@
+import os
+import hashlib
+import itertools
+import numpy as np
+import os.path as osp
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from . import ipath, iimg, imultiproc
+from .ipathtable import _encode, _decode, _pack
+
+
+# 图片头信息索引
+# 只读取每个文件头部的几百字节(见iimg.read_img_header), 不解码像素
+# 按相对路径排序后以列存放在npz中: width/height/channels/format/filesize/mtime_ns
+# 重新build时 (相对路径, mtime, 文件大小) 未变化的文件直接复用旧记录, 不再读取文件头
+
+_COLUMNS = ['width', 'height', 'channels', 'format', 'filesize', 'mtime_ns']
+_DTYPES = [np.int32, np.int32, np.uint8, np.uint8, np.int64, np.int64]
+UNKNOWN_FORMAT = 'unknown'
+IMG_META_CACHE_DIR = osp.join(osp.expanduser('~'), '.cache', 'ibasis', 'img_meta')
+
+
+class ImgMetaIndex:
+    def __init__(self, dir_, file_type='IMAGE', num_workers=16, index_path='AUTO'):
+        """
+        Args:
+            dir_: 图片目录
+            file_type: 同ipath.get_paths
+            num_workers: 扫描目录与读取文件头的线程数
+            index_path: npz索引文件, 'AUTO' 为 IMG_META_CACHE_DIR 下以 (dir_绝对路径, file_type) 的md5命名的文件,
+                不写入dir_; None 只保存在内存中
+        Attributes:
+            rel_buf, rel_off: 相对路径(utf-8)拼接后的bytes与offset, 第i条即第i小的相对路径
+            width, height, channels, format, filesize, mtime_ns: 与相对路径对齐的列
+                无法识别的文件 width=height=channels=0, format 为 formats.index('unknown')
+            formats: format列的编码表, 如 ['bmp', 'jpeg', 'png', 'unknown']
+        """
+        self.dir_ = dir_
+        self.file_type = file_type
+        self.num_workers = num_workers
+        if index_path == 'AUTO':
+            params = repr((osp.abspath(dir_), file_type))
+            name = hashlib.md5(params.encode('utf-8', 'surrogateescape')).hexdigest()
+            index_path = osp.join(IMG_META_CACHE_DIR, f"{name}.npz")
+        self.index_path = index_path
+        self._set_rows([])
+
+    def _set_rows(self, rows):
+        """rows: [(rel_path, width, height, channels, format, filesize, mtime_ns)]"""
+        rows = sorted(rows, key=lambda x: _encode(x[0]))
+        self.rel_buf, self.rel_off = _pack([_encode(row[0]) for row in rows])
+        cols = list(zip(*rows)) if len(rows) > 0 else [[]] * (len(_COLUMNS) + 1)
+        for name, dtype, col in zip(_COLUMNS, _DTYPES, cols[1:]):
+            if name == 'format':
+                self.formats, col = np.unique(np.array(col, dtype=str), return_inverse=True)
+                self.formats = self.formats.tolist()
+            setattr(self, name, np.asarray(col, dtype=dtype))
+        self._rel_arr = None
+
+    def _get_row(self, i):
+        return (self.get_rel_path(i), ) + tuple(getattr(self, name)[i].item() for name in _COLUMNS[:3]) + \
+            (self.formats[self.format[i]], self.filesize[i].item(), self.mtime_ns[i].item())
+
+    def _read_batch(self, batch, old_dic):
+        """batch: [(rel_path, abs_path)], 返回行列表, 跳过读取期间被删除的文件"""
+        rows = list()
+        for rel_path, path in batch:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            row = old_dic.get(rel_path)
+            if row is None or row[5:] != (st.st_size, st.st_mtime_ns):
+                header = iimg.read_img_header(path) or (UNKNOWN_FORMAT, 0, 0, 0)
+                fmt, w, h, c = header
+                row = (rel_path, w, h, c, fmt, st.st_size, st.st_mtime_ns)
+            rows.append(row)
+        return rows
+
+    def build(self, batch_size=1024, is_save=True):
+        """扫描目录建立索引, 已有索引文件时增量更新"""
+        old_dic = dict()
+        if self.index_path is not None and osp.exists(self.index_path):
+            self.load()
+            old_dic = {row[0]: row for row in map(self._get_row, range(len(self)))}
+        walk_iter = ipath.walk_files(self.dir_, num_workers=self.num_workers)
+        path_iter = ((rel_path, path) for _, rel_path, path in
+                     ipath._iter_key_path(self.dir_, walk_iter, self.file_type, key_mode=3))
+        batch_iter = iter(lambda: list(itertools.islice(path_iter, batch_size)), [])
+        rows = list()
+        with ThreadPoolExecutor(self.num_workers) as ex:
+            read_func = partial(self._read_batch, old_dic=old_dic)
+            for batch_rows in imultiproc.imap_ordered(ex, read_func, batch_iter, self.num_workers * 2):
+                rows.extend(batch_rows)
+        n_reuse = sum(1 for row in rows if old_dic.get(row[0]) == row)
+        self._set_rows(rows)
+        print(f"Img meta num:{len(self)}, reuse:{n_reuse}, parse:{len(self) - n_reuse}, "
+              f"unknown:{int(np.sum(self.width == 0))}")
+        if is_save and self.index_path is not None:
+            try:
+                self.save()
+            except OSError as e:
+                # 索引目录不可写时只保存在内存中
+                print(f"Save img meta index failed, keep in memory: {self.index_path}, {e}")
+        return self
+
+    def save(self):
+        ipath.make_path_dir(self.index_path)
+        # np.savez 会给不以.npz结尾的文件名补后缀, 临时文件保持.npz结尾
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, rel_buf=np.frombuffer(self.rel_buf, dtype=np.uint8), rel_off=self.rel_off,
+                 formats=np.array(self.formats, dtype=str), **{name: getattr(self, name) for name in _COLUMNS})
+        os.replace(tmp_path, self.index_path)
+
+    def load(self):
+        with np.load(self.index_path, allow_pickle=False) as data:
+            self.rel_buf = data['rel_buf'].tobytes()
+            self.rel_off = data['rel_off']
+            self.formats = data['formats'].tolist()
+            for name in _COLUMNS:
+                setattr(self, name, data[name])
+        self._rel_arr = None
+        return self
+
+    def __len__(self):
+        return len(self.rel_off) - 1
+
+    def get_rel_path(self, i):
+        st, ed = self.rel_off[i:i+2].tolist()
+        return _decode(self.rel_buf[st:ed])
+
+    def get_path(self, i):
+        return osp.join(self.dir_, self.get_rel_path(i))
+
+    def get_meta(self, i):
+        """第i条记录 -> dict"""
+        rel_path, w, h, c, fmt, filesize, _ = self._get_row(i)
+        return {'rel_path': rel_path, 'width': w, 'height': h, 'channels': c, 'format': fmt, 'filesize': filesize}
+
+    def index_many(self, paths):
+        """批量 绝对/相对路径 -> 下标, 不存在为-1, 有序数组上二分查找"""
+        if self._rel_arr is None:
+            self._rel_arr = np.array([self.rel_buf[st:ed] for st, ed in
+                                      zip(self.rel_off[:-1].tolist(), self.rel_off[1:].tolist())], dtype=np.bytes_)
+        prefix = osp.join(self.dir_, '')
+        rels = np.array([_encode(p[len(prefix):] if p.startswith(prefix) else p) for p in paths], dtype=np.bytes_)
+        if len(self) == 0:
+            return np.full(len(rels), -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self._rel_arr, rels), len(self) - 1)
+        return np.where(self._rel_arr[idx] == rels, idx, -1).astype(np.int64)
+
+    def index(self, path, default=-1):
+        idx = int(self.index_many([path])[0])
+        return idx if idx >= 0 else default
+
+    def get_mask(self, min_size=None, max_size=None, formats=None, is_valid=True):
+        """尺寸/格式过滤, 返回bool数组
+        Args:
+            min_size, max_size: (W, H), 包含边界
+            formats: 保留的格式列表, 如 ['jpeg', 'png']
+            is_valid: True 时剔除无法识别的文件
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if is_valid:
+            mask &= self.width > 0
+        if min_size is not None:
+            mask &= (self.width >= min_size[0]) & (self.height >= min_size[1])
+        if max_size is not None:
+            mask &= (self.width <= max_size[0]) & (self.height <= max_size[1])
+        if formats is not None:
+            codes = [i for i, fmt in enumerate(self.formats) if fmt in formats]
+            mask &= np.isin(self.format, codes)
+        return mask
+
+    def get_aspect_ratio(self):
+        """宽/高, 无法识别的文件为0"""
+        return np.divide(self.width, self.height, out=np.zeros(len(self), dtype=np.float32),
+                         where=self.height > 0, casting='unsafe')
+
+    def get_aspect_buckets(self, bins):
+        """按宽高比分桶, bins为递增的桶边界, 返回每条记录的桶号(同np.digitize)"""
+        return np.digitize(self.get_aspect_ratio(), bins)
+
+    def __repr__(self):
+        return f"ImgMetaIndex(dir_={self.dir_!r}, len={len(self)}, formats={self.formats})"
+
+
+def build_img_meta(dir_, file_type='IMAGE', num_workers=16, index_path='AUTO'):
+    """扫描目录建立/增量更新图片头信息索引, 见ImgMetaIndex"""
+    return ImgMetaIndex(dir_, file_type=file_type, num_workers=num_workers, index_path=index_path).build()
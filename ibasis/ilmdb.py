@@ -1,60 +1,566 @@
 import os
+import time
+import itertools
+import queue
+import random
+import weakref
+import hashlib
+import threading
+import contextlib
 import cv2
 import six
 import lmdb
 import numpy as np
 import os.path as osp
+from functools import partial
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image
 from tqdm import tqdm
-from p_tqdm import p_map
-import matplotlib.pyplot as plt
-from . import ipath
+from . import ipath, iimg, ifile, imultiproc
+
+
+def _to_bytes(x):
+    # expect x: int float str bytes
+    return x if isinstance(x, bytes) else str(x).encode()
+
+
+def _prefix_stop(prefix):
+    """以prefix开头的key的上界(不含), 即去掉末尾0xff后最后一个字节加1, 全为0xff时无上界"""
+    prefix = prefix.rstrip(b'\xff')
+    return prefix[:-1] + bytes([prefix[-1] + 1]) if prefix else None
+
+
+def _iter_cursor(txn, start=None, stop=None, values=True):
+    """按key有序yield [start, stop) 内的 key 或 (key, value), values=False 时不访问value所在的页"""
+    cursor = txn.cursor()
+    if not (cursor.first() if start is None else cursor.set_range(start)):
+        return
+    for item in cursor.iternext(keys=True, values=values):
+        if stop is not None and (item[0] if values else item) >= stop:
+            break
+        yield item
+
+
+class LMDBWriter:
+    def __init__(self, env, batch_size=1000, commit_items=100000, commit_bytes=None, is_append=False,
+                 is_verbose=True, report_interval=10, on_commit=None, is_auto_grow=False, on_grow=None):
+        """流式写入, 按批putmulti, 每commit_items条或commit_bytes字节提交一次事务
+        Args:
+            env: lmdb.Environment
+            batch_size: 每次putmulti的条数
+            commit_items, commit_bytes: 达到任一阈值时提交当前写事务
+                commit_bytes=None 时默认1GB, is_auto_grow 时默认64MB(见下)
+            is_append: key已按字节序升序且大于库中已有key时使用MDB_APPEND, 跳过B树查找
+                lmdb会跳过不递增的key而不报错, 此时抛出ValueError, 当前事务放弃
+            is_verbose: 是否输出吞吐量
+            report_interval: 输出吞吐量的间隔(秒)
+            on_commit: 每次提交后的回调, LMDB用来使读事务失效
+            is_auto_grow: 每个事务开始前预留 2*commit_bytes 的空间, 仍遇到MapFullError时加倍map_size并重放当前事务
+                为了重放, 当前事务已写入的批会保留在内存中直到提交, 即额外占用最多约commit_bytes字节,
+                因此默认commit_bytes降为64MB; 关闭时只保留当前一批
+            on_grow: 扩容前的回调, 扩容时本进程内不能有活跃的读事务, LMDB用来关闭当前线程的读事务(其他线程持有时抛出异常)
+        Usage:
+            with LMDBWriter(env) as writer:
+                writer.put(k, v)
+                writer.put_many(iterable_of_kv)
+        """
+        self.env = env
+        self.batch_size = batch_size
+        self.commit_items = commit_items
+        if commit_bytes is None:
+            commit_bytes = 64 << 20 if is_auto_grow else 1 << 30
+        self.commit_bytes = commit_bytes
+        self.is_append = is_append
+        self.is_verbose = is_verbose
+        self.report_interval = report_interval
+        self.on_commit = on_commit
+        self.is_auto_grow = is_auto_grow
+        self.on_grow = on_grow
+        self.n_items, self.n_bytes = 0, 0
+        self._batch = list()
+        self._txn = None
+        self._txn_batches = list()  # 当前事务中待写入/已写入(自动扩容时用于重放)的批
+        self._n_put = 0             # _txn_batches 中已写入当前事务的批数
+        self._txn_items, self._txn_bytes = 0, 0
+        self._st = self._last_report = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # 出错时放弃未提交的部分, 已提交的事务保留
+            self._batch, self._txn_batches = list(), list()
+            self._abort_txn()
+
+    def put(self, key, value):
+        key, value = _to_bytes(key), _to_bytes(value)
+        self._batch.append((key, value))
+        self._txn_items += 1
+        self._txn_bytes += len(key) + len(value)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def put_many(self, items):
+        """items: 可迭代的 (key, value)"""
+        for key, value in items:
+            self.put(key, value)
+
+    def _abort_txn(self):
+        if self._txn is not None:
+            self._txn.abort()
+            self._txn = None
+        self._n_put = 0
+
+    def _grow(self, min_size=0):
+        map_size = max(self.env.info()['map_size'] * 2, min_size)
+        if self.on_grow is not None:
+            self.on_grow()
+        self.env.set_mapsize(map_size)
+        if self.is_verbose:
+            print(f"map_size 扩大为: {map_size/2**20:.1f} MB")
+
+    def _ensure_space(self):
+        # 预估本事务最多需要的空间, 提前扩容, 避免写到一半才MapFullError
+        info, psize = self.env.info(), self.env.stat()['psize']
+        need = (info['last_pgno'] + 1) * psize + 2 * self.commit_bytes
+        if need > info['map_size']:
+            self._grow(need)
+
+    def _sync(self, is_commit=False):
+        """将_txn_batches写入事务, is_commit 时提交; 自动扩容时MapFullError后扩容并重放整个事务"""
+        while True:
+            try:
+                if self._txn is None:
+                    if self.is_auto_grow:
+                        self._ensure_space()
+                    self._txn = self.env.begin(write=True)
+                for batch in self._txn_batches[self._n_put:]:
+                    consumed, added = self._txn.cursor().putmulti(batch, append=self.is_append)
+                    if added < consumed:
+                        self._check_append(batch)
+                    self._n_put += 1
+                if not self.is_auto_grow:
+                    self._txn_batches, self._n_put = list(), 0
+                if is_commit and self._txn is not None:
+                    self._txn.commit()
+                    self._txn = None
+                    self._txn_batches, self._n_put = list(), 0
+                return
+            except lmdb.MapFullError:
+                if not self.is_auto_grow:
+                    raise
+                self._abort_txn()
+                self._grow()
+
+    def _check_append(self, batch):
+        """is_append 时MDB_APPEND跳过了不递增的key, 找出第一个并放弃当前事务"""
+        # 批内均递增时, 是批的第一个key不大于库中已有key
+        key = next((k2 for (k1, _), (k2, _) in zip(batch, batch[1:]) if k2 <= k1), batch[0][0])
+        self._batch, self._txn_batches = list(), list()
+        self._abort_txn()
+        raise ValueError(f"is_append 时key需按字节序递增且大于库中已有key, 在{key!r}处不满足")
+
+    def flush(self):
+        """将当前批写入事务, 达到阈值时提交"""
+        if len(self._batch) > 0:
+            self._txn_batches.append(self._batch)
+            self._sync()
+            self.n_items += len(self._batch)
+            self.n_bytes += sum(len(k) + len(v) for k, v in self._batch)
+            self._batch = list()
+        if self._txn_items >= self.commit_items or self._txn_bytes >= self.commit_bytes:
+            self.commit()
+        if self.is_verbose and time.time() - self._last_report > self.report_interval:
+            self._last_report = time.time()
+            self.report()
+
+    def commit(self):
+        if len(self._batch) > 0:
+            self.flush()
+        if self._txn is not None:
+            self._sync(is_commit=True)
+            if self.on_commit is not None:
+                self.on_commit()
+        self._txn_items, self._txn_bytes = 0, 0
+
+    def close(self):
+        self.commit()
+        if self.is_verbose:
+            self.report(is_final=True)
+
+    def report(self, is_final=False):
+        used = max(time.time() - self._st, 1e-9)
+        print(f"{'写入完成' if is_final else '写入中'}: {self.n_items} items, {self.n_items/used:.1f} items/s, "
+              f"{self.n_bytes/used/2**20:.1f} MB/s, used:{used:.1f}s")
+
+
+class LMDBReadSession:
+    def __init__(self, db, buffers=False, max_age=10):
+        """每个线程持有一个只读事务并复用, 避免每次get都begin/abort
+        Args:
+            db: LMDB, 其generation变化(本对象写入或fork后重新打开)时各线程会在下次读取时更新事务
+            buffers: True 时value为指向mmap的memoryview, 不复制数据, 只在下一次读取前有效
+            max_age: 事务最长复用时间(秒), 超过后在下次读取时重新开始, None 为不限制
+                读事务会固定其开始时的快照, 快照之后被释放的页在事务结束前不能被写入复用,
+                有其他进程同时写入时会使数据文件持续增长, 同时也使其他进程的写入在max_age内可见
+        Note:
+            fork后(如DataLoader workers)检测到pid变化时由db重新打开env, 继承自父进程的事务直接丢弃
+        """
+        self.db = weakref.proxy(db)     # 避免循环引用, 使LMDB对象释放时env能及时关闭
+        self.buffers = buffers
+        self.max_age = max_age
+        self._local = threading.local()
+        db._sessions.add(self)
+
+    def _get_txn(self):
+        db = self.db
+        if os.getpid() != db._pid:
+            db._reopen()
+        local = self._local
+        txn = getattr(local, 'txn', None)
+        if txn is None or local.generation != db._generation or \
+                (self.max_age is not None and time.monotonic() - local.st > self.max_age):
+            if txn is not None:
+                txn.abort()
+            local.txn = txn = db.env.begin(buffers=self.buffers)
+            local.generation = db._generation
+            local.st = time.monotonic()
+            db._read_txns[txn] = threading.get_ident()
+        return txn
+
+    def refresh(self):
+        """丢弃当前线程的事务, 下次读取时看到最新数据"""
+        txn = getattr(self._local, 'txn', None)
+        self._local.txn = None
+        if txn is not None and os.getpid() == self.db._pid:
+            txn.abort()
+
+    def get(self, key):
+        return self._get_txn().get(key)
+
+    def get_many(self, keys, func=None):
+        """批量读取, 按key排序后用同一cursor查找, 返回与keys顺序一致的列表, 不存在的key为None
+        Args:
+            func: 对每个value的处理, 在buffer有效期内调用, 如解码图片
+        """
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        res = [None] * len(keys)
+        cursor = self._get_txn().cursor()
+        for i in order:
+            if cursor.set_key(keys[i]):
+                res[i] = cursor.value() if func is None else func(cursor.value())
+        return res
+
+
+# lmdb.open 参数预设, 可被LMDB(**env_kwargs)覆盖
+ENV_PROFILES = {
+    # lmdb默认参数, 可读写
+    'default': dict(),
+    # 只读训练数据: 不加锁(要求没有进程同时写入), 关闭预读(随机读时预读只会浪费IO和page cache)
+    'read': dict(readonly=True, lock=False, readahead=False),
+    # 只读但可能有进程同时写入, 保留锁
+    'read_shared': dict(readonly=True, readahead=False, max_readers=2048),
+    # 批量写入: 不初始化未使用的内存, 写入时按需扩大map_size
+    'write': dict(meminit=False, readahead=False),
+}
 
 
 class LMDB:
-    def __init__(self, lmdb_dir, cache_dic=None, map_size=1099511627776):
-        # cache_dic both k,v should be byte
-        # map_size(KB), default=1T
+    def __init__(self, lmdb_dir, cache_dic=None, map_size=1099511627776, profile='default', is_auto_grow=None,
+                 **env_kwargs):
+        """
+        Args:
+            cache_dic: both k,v should be byte
+            map_size: 字节, default=1T, 只读时不影响
+            profile: ENV_PROFILES 中的预设, 'default' / 'read' / 'read_shared' / 'write'
+            is_auto_grow: 写入时是否自动扩大map_size, None 时 profile='write' 开启
+            env_kwargs: 透传给lmdb.open, 覆盖profile, 如 subdir / max_readers / writemap
+        """
+        if profile not in ENV_PROFILES:
+            raise NotImplementedError(f"profile 类型有误, 期望{list(ENV_PROFILES.keys())}, 输入:{profile}")
         self.lmdb_dir = lmdb_dir
         self.cache_dic = cache_dic
-        self.env = lmdb.open(lmdb_dir, map_size)
+        self.map_size = map_size
+        self.profile = profile
+        self.is_auto_grow = profile == 'write' if is_auto_grow is None else is_auto_grow
+        self.env_kwargs = {**ENV_PROFILES[profile], **env_kwargs, 'map_size': map_size}
+        self.env = lmdb.open(lmdb_dir, **self.env_kwargs)
+        self._pid = os.getpid()
+        self._generation = 0
+        self._sessions = weakref.WeakSet()
+        self._read_txns = weakref.WeakKeyDictionary()     # {读事务: 所属线程}
+        self.session = LMDBReadSession(self)
+        self.buf_session = LMDBReadSession(self, buffers=True)
+
+    def _reopen(self):
+        # 继承自父进程的env在子进程中既不能使用, 也不能close(会释放父进程持有的reader slot)
+        # py-lmdb在子进程中释放env/事务对象时不会关闭它们, 只注销"已打开"记录, 丢弃所有引用后即可重新打开
+        for session in list(self._sessions):
+            session._local = threading.local()
+        self._read_txns = weakref.WeakKeyDictionary()
+        self.env = None
+        try:
+            self.env = lmdb.open(self.lmdb_dir, **self.env_kwargs)
+        except lmdb.Error as e:
+            raise RuntimeError(f"fork后在子进程中重新打开lmdb失败: {self.lmdb_dir}, 子进程中可能仍有对象引用父进程的env "
+                               f"(如LMDBWriter/未结束的iter_range), 请在fork之后再创建LMDB对象. {e}") from e
+        self._pid = os.getpid()
+        self._generation += 1
+
+    def _on_write(self):
+        self._generation += 1
+
+    def _drop_read_txns(self):
+        # set_mapsize 时本进程不能有活跃的读事务; 事务不能跨线程abort, 只关闭当前线程会话中的事务,
+        # 其他线程仍持有读事务时拒绝扩容. generation变化后各会话在下次读取时重新打开事务
+        me, n_other = threading.get_ident(), 0
+        for txn, ident in list(self._read_txns.items()):
+            if ident == me:
+                txn.abort()
+            else:
+                n_other += 1
+        self._generation += 1
+        if n_other > 0:
+            raise RuntimeError(f"其他线程持有{n_other}个读事务, 不能扩大map_size, "
+                               f"写入期间请暂停其他线程的读取(或各自调用会话的refresh()), 或预先设置足够的map_size")
 
     def _cvt_key(self, key):
         # expect key: int float str
         return key.encode() if not isinstance(key, bytes) else key
 
-    def write(self, append_cache_dic={}):
+    def writer(self, **kwargs):
+        """返回流式写入器, 参数见LMDBWriter"""
+        kwargs.setdefault('on_commit', self._on_write)
+        kwargs.setdefault('is_auto_grow', self.is_auto_grow)
+        kwargs.setdefault('on_grow', self._drop_read_txns)
+        return LMDBWriter(self.env, **kwargs)
+
+    def _merge_cache(self, append_cache_dic):
         assert isinstance(append_cache_dic, dict), "append_cache should be dict"
-        append_cache_dic.update(self.cache_dic)
-        with self.env.begin(write=True) as txn:
-            for k, v in append_cache_dic.items():
-                txn.put(self._cvt_key(k), self._cvt_key(v))
+        # 同名key以cache_dic为准, 不修改传入的字典
+        return {**append_cache_dic, **(self.cache_dic or {})}
+
+    def write(self, append_cache_dic={}, **kwargs):
+        """写入append_cache_dic与cache_dic, 返回写入的条数, kwargs 见LMDBWriter"""
+        cache_dic = self._merge_cache(append_cache_dic)
+        with self.writer(**kwargs) as writer:
+            writer.put_many(cache_dic.items())
+        return len(cache_dic)
 
     def get(self, key):
-        key = self._cvt_key(key)
-        with self.env.begin() as txn:
-            return txn.get(key)
+        return self.session.get(self._cvt_key(key))
 
-    def get_all(self, only_key=False, only_value=False, include=None):
+    def get_many(self, keys):
+        """批量读取, 返回与keys顺序一致的value列表, 不存在的key为None"""
+        return self.session.get_many([self._cvt_key(k) for k in keys])
+
+    def _fmt_range(self, start=None, stop=None, prefix=None):
+        start = None if start is None else self._cvt_key(start)
+        stop = None if stop is None else self._cvt_key(stop)
+        if prefix is not None:
+            prefix = self._cvt_key(prefix)
+            start = prefix if start is None else max(start, prefix)
+            prefix_stop = _prefix_stop(prefix)
+            if prefix_stop is not None:
+                stop = prefix_stop if stop is None else min(stop, prefix_stop)
+        return start, stop
+
+    def iter_range(self, start=None, stop=None, prefix=None, values=True):
+        """按key有序迭代 [start, stop) 且以prefix开头的记录, 基于cursor.set_range, 不扫描范围外的key
+        Args:
+            values: False 时只yield key(bytes), 不读取value
+        """
+        start, stop = self._fmt_range(start, stop, prefix)
         with self.env.begin() as txn:
-            for key, value in txn.cursor():
-                if include is not None:
-                    if include not in str(key.decode()):
-                        continue
-                if only_key:
-                    yield str(key.decode())
-                elif only_value:
-                    yield value
-                else:
-                    yield str(key.decode()), value
+            yield from _iter_cursor(txn, start, stop, values)
+
+    def split_range(self, num_chunks, start=None, stop=None, prefix=None):
+        """将key范围按条数均分为不相交的num_chunks段, 返回 [(start, stop)], 只读取key"""
+        start, stop = self._fmt_range(start, stop, prefix)
+        keys = list(self.iter_range(start, stop, values=False))
+        step = max(-(-len(keys) // max(num_chunks, 1)), 1)
+        bounds = [start] + keys[step::step] + [stop]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _iter_range_parallel(self, start, stop, values, num_workers):
+        """各线程独立事务读取不相交的key段, 按key顺序yield, 同时最多缓存 num_workers+1 段"""
+        ranges = self.split_range(num_workers * 4, start, stop)
+        read_chunk = lambda rng: list(self.iter_range(*rng, values=values))
+        with ThreadPoolExecutor(num_workers) as ex:
+            futures = [ex.submit(read_chunk, rng) for rng in ranges[:num_workers + 1]]
+            for i in range(len(ranges)):
+                chunk = futures[i].result()
+                futures[i] = None
+                if i + num_workers + 1 < len(ranges):
+                    futures.append(ex.submit(read_chunk, ranges[i + num_workers + 1]))
+                yield from chunk
+
+    def get_all(self, only_key=False, only_value=False, include=None, prefix=None, start=None, stop=None,
+                num_workers=None):
+        """
+        Args:
+            only_key, only_value: 只返回key(str) / value
+            include: key中包含的字符串, 需要逐条判断, 能用prefix时优先用prefix
+            prefix, start, stop: 只扫描以prefix开头且在[start, stop)内的key
+            num_workers: >1 时按key范围分段并行读取value, 顺序不变
+        """
+        values = not only_key
+        start, stop = self._fmt_range(start, stop, prefix)
+        if num_workers is not None and num_workers > 1 and values:
+            item_iter = self._iter_range_parallel(start, stop, values, num_workers)
+        else:
+            item_iter = self.iter_range(start, stop, values=values)
+        for item in item_iter:
+            key = item[0] if values else item
+            if include is not None:
+                if include not in str(key.decode()):
+                    continue
+            if only_key:
+                yield str(key.decode())
+            elif only_value:
+                yield item[1]
+            else:
+                yield str(key.decode()), item[1]
+
+    # === 维护 ===
+    def get_stat(self):
+        """env.stat() + env.info() 以及文件大小/空间利用率"""
+        stat, info = self.env.stat(), self.env.info()
+        data_path = osp.join(self.lmdb_dir, 'data.mdb') if self.env_kwargs.get('subdir', True) else self.lmdb_dir
+        n_used = stat['branch_pages'] + stat['leaf_pages'] + stat['overflow_pages']
+        n_alloc = info['last_pgno'] + 1
+        return {**stat, **info,
+                'file_size': osp.getsize(data_path),
+                'used_size': n_used * stat['psize'],
+                # 已分配但主库未使用的页(空闲页/元数据), compact 可回收
+                'free_ratio': 1 - n_used / max(n_alloc, 1)}
+
+    def get_prefix_hist(self, sep='-', prefix=None):
+        """按key中第一个sep之前的部分统计数量, 只读取key, 如 {'image': n, 'label': n, 'num': 1}"""
+        hist = dict()
+        sep = self._cvt_key(sep)
+        for key in self.iter_range(prefix=prefix, values=False):
+            k = bytes(key).split(sep, 1)[0].decode(errors='replace')
+            hist[k] = hist.get(k, 0) + 1
+        return hist
 
-    def __del__(self):
-        self.env.close()
+    def compact(self, out_dir):
+        """压缩拷贝到out_dir(不能已存在数据), 跳过空闲页, 用于删除大量数据后缩小文件, 返回 (原大小, 新大小)
+        subdir=False 时out_dir即为输出的数据文件路径, 与lmdb_dir的含义一致
+        """
+        if self.env_kwargs.get('subdir', True):
+            os.makedirs(out_dir, exist_ok=True)
+            self.env.copy(out_dir, compact=True)
+            dst_path = osp.join(out_dir, 'data.mdb')
+        else:
+            ipath.make_path_dir(out_dir)
+            with open(out_dir, 'xb') as f:
+                self.env.copyfd(f.fileno(), compact=True)
+            dst_path = out_dir
+        src_size = self.get_stat()['file_size']
+        dst_size = osp.getsize(dst_path)
+        print(f"compact: {self.lmdb_dir} {src_size/2**20:.1f} MB -> {out_dir} {dst_size/2**20:.1f} MB")
+        return src_size, dst_size
+
+    def __del__(self, _getpid=os.getpid):
+        # 解释器退出时模块全局变量可能已被清理, 预先绑定getpid
+        if getattr(self, '_pid', None) == _getpid() and self.env is not None:
+            self.env.close()
+
+
+KEY_INDEX_CACHE_DIR = osp.join(osp.expanduser('~'), '.cache', 'ibasis', 'lmdb_key_index')
+
+
+class LMDBKeyIndex(Sequence):
+    def __init__(self, prefix, num=None, keys=None):
+        """某一类key(如image)的下标索引, 下标i对应第i个key(从0开始), 访问k个key的代价为O(k)
+        Args:
+            prefix: key前缀, 如 'image'
+            num: 符合 '{prefix}-%09d'(从1开始, 连续) 命名约定时的数量, 此时不需要保存key
+            keys: 不符合命名约定时的有序key数组(np.bytes_), 见LMDB_OCR.get_key_index
+        """
+        self.prefix = prefix
+        self.num = num
+        self.keys = keys
+
+    def __len__(self):
+        return self.num if self.keys is None else len(self.keys)
+
+    def _get(self, idx):
+        if self.keys is None:
+            return f"{self.prefix}-{idx + 1:09d}"
+        return self.keys[idx].decode()
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._get(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Index {idx} out of range {len(self)}")
+        return self._get(idx)
+
+    def sample(self, num, seed=None):
+        """无放回随机取num个key, 代价O(num)"""
+        rand = random if seed is None else random.Random(seed)
+        return [self._get(i) for i in rand.sample(range(len(self)), min(num, len(self)))]
+
+    def shard(self, shard_id, num_shards):
+        """第shard_id份(共num_shards份)的key, 按下标交错划分"""
+        return self[shard_id::num_shards]
 
 
 class LMDB_OCR(LMDB):
-    def __init__(self, lmdb_dir, cache_dic=None, map_size=1099511627776):
-        super(LMDB_OCR, self).__init__(lmdb_dir, cache_dic, map_size)
+    def __init__(self, lmdb_dir, cache_dic=None, map_size=1099511627776, profile='default', is_auto_grow=None,
+                 **env_kwargs):
+        super(LMDB_OCR, self).__init__(lmdb_dir, cache_dic, map_size, profile, is_auto_grow, **env_kwargs)
+        self._key_index_dic = dict()    # {prefix: (generation, LMDBKeyIndex)}
+
+    def get_num_samples(self):
+        num = self.get('num-samples')
+        return None if num is None else int(num)
+
+    def _build_key_index(self, prefix, cache_dir=None):
+        txn = self.session._get_txn()
+        num = self.get_num_samples()
+        if num is not None and (num == 0 or (txn.get(f"{prefix}-{1:09d}".encode()) is not None
+                                             and txn.get(f"{prefix}-{num:09d}".encode()) is not None
+                                             and txn.get(f"{prefix}-{num + 1:09d}".encode()) is None)):
+            return LMDBKeyIndex(prefix, num=num)
+        # 不符合命名约定, 读取/生成缓存目录中的sidecar, 以last_txnid判断是否过期
+        cache_dir = KEY_INDEX_CACHE_DIR if cache_dir is None else cache_dir
+        name = hashlib.md5(repr((osp.abspath(self.lmdb_dir), prefix)).encode('utf-8', 'surrogateescape')).hexdigest()
+        sidecar_path = osp.join(cache_dir, f"{name}.npz")
+        last_txnid = self.env.info()['last_txnid']
+        if osp.exists(sidecar_path):
+            with np.load(sidecar_path) as data:
+                if int(data['last_txnid']) == last_txnid:
+                    return LMDBKeyIndex(prefix, keys=data['keys'])
+        keys = np.array(list(self.iter_range(prefix=prefix, values=False)), dtype=np.bytes_)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # np.savez 会给不以.npz结尾的文件名补后缀, 临时文件保持.npz结尾
+            tmp_path = f"{sidecar_path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, keys=keys, last_txnid=last_txnid)
+            os.replace(tmp_path, sidecar_path)
+        except OSError as e:
+            # 缓存目录不可写时只保存在内存中
+            print(f"Save key index sidecar failed, keep in memory: {sidecar_path}, {e}")
+        return LMDBKeyIndex(prefix, keys=keys)
+
+    def get_key_index(self, prefix='image', cache_dir=None):
+        """返回prefix类key的LMDBKeyIndex, 优先使用num-samples + '{prefix}-%09d' 约定, 否则使用sidecar索引
+        cache_dir: sidecar所在目录, None 为KEY_INDEX_CACHE_DIR, 以lmdb_dir绝对路径的md5命名, 不写入lmdb_dir
+        """
+        generation, key_index = self._key_index_dic.get(prefix, (None, None))
+        if generation != self._generation:
+            key_index = self._build_key_index(prefix, cache_dir)
+            self._key_index_dic[prefix] = (self._generation, key_index)
+        return key_index
 
     def _cvt_imgbuf_to_img(self, key, imgbuf):
         buf = six.BytesIO()
@@ -71,49 +577,446 @@ class LMDB_OCR(LMDB):
         imgbuf = self.get(key)
         return self._cvt_imgbuf_to_img(key, imgbuf)
 
+    def get_img_arr(self, key, reduce=1, is_gray=False, backend='auto'):
+        """直接从mmap中的数据解码为BGR np.ndarray, 参数见iimg.decode_img, key不存在或解码失败返回None"""
+        imgbuf = self.buf_session.get(self._cvt_key(key))
+        if imgbuf is None:
+            return None
+        return iimg.decode_img(imgbuf, reduce=reduce, is_gray=is_gray, backend=backend)
+
+    def get_img_arrs(self, keys, reduce=1, is_gray=False, backend='auto'):
+        """批量版get_img_arr, 按key排序读取"""
+        func = partial(iimg.decode_img, reduce=reduce, is_gray=is_gray, backend=backend)
+        return self.buf_session.get_many([self._cvt_key(k) for k in keys], func=func)
+
     def get_lbl(self, key):
-        key = self._cvt_key(key)
         return str(self.get(key).decode())
 
-    def get_batch_img(self, batchs_size=None, is_shuffle=False):
-        k_lis = list(self.get_all(only_key=True, include='image'))
-        if is_shuffle:
-            np.random.shuffle(k_lis)
-        if batchs_size is not None:
-            k_lis = k_lis[:batchs_size]
+    def get_batch_img(self, batchs_size=None, is_shuffle=False, seed=None):
+        key_index = self.get_key_index('image')
+        if batchs_size is None:
+            batchs_size = len(key_index)
+        k_lis = key_index.sample(batchs_size, seed) if is_shuffle else key_index[:batchs_size]
         for k in k_lis:     # k: str here
             yield k, self.get_img(k)
 
-    def write(self, append_cache_dic={}):
-        super().write(append_cache_dic)
-        append_cache_dic.update(self.cache_dic)
+    def get_shard_img(self, shard_id, num_shards):
+        """按下标交错分片迭代图片, 用于多进程/多机各自处理一份"""
+        for k in self.get_key_index('image').shard(shard_id, num_shards):
+            yield k, self.get_img(k)
+
+    def validate_imgs(self, prefix='image', num_workers=None, batch_size=64):
+        """多进程解码所有图片, 返回无法解码的key列表, 读取仍按key顺序流式进行"""
+        def _iter_batch():
+            batch = list()
+            for key, imgbuf in self.iter_range(prefix=prefix):
+                batch.append((key.decode(), imgbuf))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = list()
+            if len(batch) > 0:
+                yield batch
+
+        bad_keys, cnt = list(), 0
+        with ProcessPoolExecutor(num_workers) as ex:
+            pbar = tqdm(total=self.get_num_samples())
+            for n, keys in imultiproc.imap_ordered(ex, _validate_img_batch, _iter_batch()):
+                bad_keys.extend(keys)
+                cnt += n
+                pbar.update(n)
+            pbar.close()
+        print(f"损坏/总数: {len(bad_keys)}/{cnt}")
+        return bad_keys
+
+    def write(self, append_cache_dic={}, **kwargs):
+        n = super().write(append_cache_dic, **kwargs)
+        # append模式下num-samples不一定在所有key之后, 单独提交
         with self.env.begin(write=True) as txn:
-            txn.put(b'num-samples', str(len(append_cache_dic)//2).encode())
+            txn.put(b'num-samples', str(n//2).encode())
+        self._on_write()
+        return n
+
+
+class ShardedLMDB:
+    def __init__(self, lmdb_dirs, profile='read', **env_kwargs):
+        """多个LMDB_OCR组成的统一数据集, 全局下标 -> (分片, 分片内key), 不需要合并成一个大库
+        Args:
+            lmdb_dirs: 各分片目录
+            profile, env_kwargs: 见LMDB
+        Note:
+            构造时只短暂打开各分片读取数量; env在每个进程第一次访问时才打开,
+            fork/pickle到DataLoader workers后各自重新打开
+        """
+        self.lmdb_dirs = list(lmdb_dirs)
+        self.profile = profile
+        self.env_kwargs = env_kwargs
+        nums = list()
+        for lmdb_dir in self.lmdb_dirs:
+            db = LMDB_OCR(lmdb_dir, profile=profile, **env_kwargs)
+            num = db.get_num_samples()
+            nums.append(len(db.get_key_index('image')) if num is None else num)
+            del db
+        self.nums = np.array(nums, dtype=np.int64)
+        self.offsets = np.zeros(len(nums) + 1, dtype=np.int64)
+        np.cumsum(self.nums, out=self.offsets[1:])
+        self._dbs = dict()
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_dbs'] = dict()
+        return state
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _get_db(self, shard):
+        if os.getpid() != self._pid:
+            # 继承自父进程的env不能在子进程中使用或关闭, 只丢弃引用
+            self._dbs = dict()
+            self._pid = os.getpid()
+        db = self._dbs.get(shard)
+        if db is None:
+            db = LMDB_OCR(self.lmdb_dirs[shard], profile=self.profile, **self.env_kwargs)
+            self._dbs[shard] = db
+        return db
+
+    def locate(self, idx):
+        """全局下标 -> (分片下标, 分片内下标), 支持np.ndarray批量计算, O(log 分片数)"""
+        idx = np.asarray(idx)
+        if np.any((idx < 0) | (idx >= len(self))):
+            raise IndexError(f"Index out of range {len(self)}")
+        shard = np.searchsorted(self.offsets, idx, side='right') - 1
+        return shard, idx - self.offsets[shard]
+
+    def get_key(self, idx):
+        """全局下标 -> (分片下标, 图片key)"""
+        shard, local_idx = self.locate(idx)
+        shard = int(shard)
+        return shard, self._get_db(shard).get_key_index('image')[int(local_idx)]
+
+    def get_img_arr(self, idx, **kwargs):
+        """kwargs 见iimg.decode_img"""
+        shard, key = self.get_key(idx)
+        return self._get_db(shard).get_img_arr(key, **kwargs)
+
+    def get_lbl(self, idx):
+        shard, key = self.get_key(idx)
+        return self._get_db(shard).get_lbl(key.replace('image', 'label', 1))
+
+    def __getitem__(self, idx):
+        """idx -> (BGR图片, 标注)"""
+        shard, key = self.get_key(idx)
+        db = self._get_db(shard)
+        return db.get_img_arr(key), db.get_lbl(key.replace('image', 'label', 1))
+
+    def _fmt_weights(self, weights):
+        weights = np.ones(len(self.nums)) if weights is None else np.asarray(weights, dtype=np.float64)
+        if len(weights) != len(self.nums):
+            raise ValueError(f"Length of weights({len(weights)}) != num of shards({len(self.nums)})")
+        if self.nums.sum() == 0:
+            raise ValueError(f"All {len(self.nums)} shards are empty, nothing to sample")
+        # 空分片不参与采样
+        weights = np.where(self.nums > 0, weights, 0)
+        if weights.sum() <= 0:
+            raise ValueError(f"Sum of weights on non-empty shards must be > 0, weights: {weights.tolist()}")
+        return weights / weights.sum()
+
+    def sample_indices(self, num, weights=None, seed=None):
+        """按分片权重有放回采样num个全局下标, 分片内均匀, weights=None 时各分片等概率"""
+        rng = np.random.default_rng(seed)
+        shard = rng.choice(len(self.nums), size=num, p=self._fmt_weights(weights))
+        return self.offsets[shard] + (rng.random(num) * self.nums[shard]).astype(np.int64)
+
+    def get_sample_weights(self, weights=None):
+        """每个样本的采样权重, 可直接用于torch.utils.data.WeightedRandomSampler"""
+        weights = self._fmt_weights(weights)
+        return np.repeat(weights / np.maximum(self.nums, 1), self.nums)
+
+
+def _validate_img_batch(batch):
+    # reduce=8 时JPEG在解码阶段缩小, 比完整解码快
+    return len(batch), [key for key, imgbuf in batch if iimg.decode_img(imgbuf, reduce=8) is None]
+
 
 def write(arg):
-    cv2.imwrite(arg[0], arg[1])
+    # arg: (path, img), img 为np.ndarray 或图片编码数据
+    # 编码数据本身是JPEG且保存为.jpg时直接写入, 不解码再重新编码
+    path, img = arg
+    if isinstance(img, (bytes, bytearray, memoryview)):
+        if path.lower().endswith(('.jpg', '.jpeg')) and bytes(img[:2]) == b'\xff\xd8':
+            with open(path, 'wb') as f:
+                f.write(img)
+            return
+        img = iimg.decode_img(img)
+        if img is None:
+            raise ValueError(f"Decode image failed: {path}")
+    cv2.imwrite(path, img)
 
-def gen_img_lbl(lmdb_dir, out_dir):
-    locr = LMDB_OCR(lmdb_dir)
+
+def _write_img_batch(img_dir, batch):
+    for key, imgbuf in batch:
+        write((osp.join(img_dir, f"{key}.jpg"), imgbuf))
+    return [key for key, _ in batch]
+
+
+def gen_img_lbl(lmdb_dir, out_dir, num_workers=None, batch_size=64, journal_path='AUTO'):
+    """将OCR lmdb导出为 images/{key}.jpg 与 labels/labels.txt
+    Args:
+        num_workers: 解码/写图片的进程数, None 为cpu数
+        batch_size: 每个任务包含的图片数
+        journal_path: 记录已导出的key, 中断后重新运行直接跳过, 不需要重新扫描输出目录
+            首行记录lmdb绝对路径与last_txnid, 与当前lmdb不一致时忽略旧日志重新导出; 全部成功后删除日志
+            'AUTO': out_dir/.gen_img_lbl.journal, None: 不记录
+    Note:
+        读线程按key顺序分批读取图片, 进程池写图片, 每批完成后写入日志; labels.txt 每次流式重新生成
+    """
+    locr = LMDB_OCR(lmdb_dir, profile='read')
     img_dir = osp.join(out_dir, 'images')
     lbl_dir = osp.join(out_dir, 'labels')
     os.makedirs(img_dir, exist_ok=True)
     os.makedirs(lbl_dir, exist_ok=True)
-    res_lis = []
-    path_dic = ipath.get_paths(img_dir, key_mode=0)
-    arg_lis = []
-    for k in tqdm(locr.get_all(only_key=True)):
-        if k in path_dic:
-            continue
-        if 'image' in k:
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+
+    # labels 体积小, 流式写入临时文件后替换
+    lbl_path = osp.join(lbl_dir, 'labels.txt')
+    n_lbl = 0
+    with open(f"{lbl_path}.tmp", 'w') as f:
+        for key, lbl in locr.iter_range(prefix='label'):
+            f.write(f"{key.decode().replace('label', 'image')}.jpg,{lbl.decode()}\n")
+            n_lbl += 1
+    os.replace(f"{lbl_path}.tmp", lbl_path)
+    print(f"labels: {n_lbl}, {lbl_path}")
+
+    if journal_path == 'AUTO':
+        journal_path = osp.join(out_dir, '.gen_img_lbl.journal')
+    header = f"# {osp.abspath(lmdb_dir)}\t{locr.env.info()['last_txnid']}"
+    done_set = ifile._load_journal(journal_path)
+    if header in done_set:
+        done_set.discard(header)
+        print(f"从日志恢复, 已导出: {len(done_set)}, {journal_path}")
+    elif len(done_set) > 0:
+        print(f"日志来自其他lmdb或lmdb已被修改, 重新导出: {journal_path}")
+        done_set = set()
+
+    batch_queue = queue.Queue(maxsize=num_workers * 2)
+    read_err = list()
+
+    def _read():
+        try:
+            batch = list()
+            for key, imgbuf in locr.iter_range(prefix='image'):
+                key = key.decode()
+                if key in done_set:
+                    continue
+                batch.append((key, imgbuf))
+                if len(batch) >= batch_size:
+                    batch_queue.put(batch)
+                    batch = list()
+            if len(batch) > 0:
+                batch_queue.put(batch)
+        except Exception as e:
+            read_err.append(e)
+        finally:
+            batch_queue.put(None)
+
+    cnt, n_fail = 0, 0
+    journal = None
+    if journal_path:
+        journal = open(journal_path, 'a' if len(done_set) > 0 else 'w')
+        if len(done_set) == 0:
+            journal.write(f"{header}\n")
+    pbar = tqdm(total=max((locr.get_num_samples() or 0) - len(done_set), 0))
+
+    def _collect(futures):
+        nonlocal cnt, n_fail
+        for fut in futures:
+            try:
+                keys = fut.result()
+            except Exception as e:
+                n_fail += 1
+                print(f"导出失败: {e}")
+                continue
+            cnt += len(keys)
+            pbar.update(len(keys))
+            if journal is not None:
+                journal.writelines(f"{k}\n" for k in keys)
+                journal.flush()
+
+    reader = threading.Thread(target=_read, daemon=True)
+    try:
+        # 子进程全部启动后再启动读线程, 避免在已有线程的进程中fork
+        with imultiproc.start_process_pool(num_workers) as ex:
+            reader.start()
+            pending = set()
+            for batch in iter(batch_queue.get, None):
+                pending.add(ex.submit(_write_img_batch, img_dir, batch))
+                if len(pending) >= num_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    _collect(done)
+            _collect(pending)
+    finally:
+        pbar.close()
+        if journal is not None:
+            journal.close()
+    reader.join()
+    if len(read_err) > 0:
+        raise read_err[0]
+    if journal_path and n_fail == 0:
+        os.remove(journal_path)
+    print(f"images: {cnt}, skip: {len(done_set)}, failed batch: {n_fail}, {img_dir}")
+
+
+def read_txt_lbl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def _read_sample(item, lbl_reader=read_txt_lbl):
+    key, img_path, lbl_path = item
+    with open(img_path, 'rb') as f:
+        imgbuf = f.read()
+    return key, imgbuf, lbl_reader(lbl_path)
+
+
+def _check_sample_batch(batch, check_mode='validate', quality=95):
+    # 解码失败的样本imgbuf置为None; reencode 时统一重新编码为jpg
+    res = list()
+    for key, imgbuf, lbl in batch:
+        img = iimg.decode_img(imgbuf)
+        if img is None:
+            imgbuf = None
+        elif check_mode == 'reencode':
+            imgbuf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+        res.append((key, imgbuf, lbl))
+    return res
+
+
+def _iter_batch(iterable, batch_size):
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def build_lmdb(pairs, lmdb_dir, lbl_reader=read_txt_lbl, check_mode=None, num_threads=16, num_workers=None,
+               batch_size=64, quality=95, map_size=1 << 30, **writer_kwargs):
+    """由图片/标注路径对构建OCR lmdb, 按 image-%09d / label-%09d 存放, 最后写入num-samples
+    Args:
+        pairs: 可迭代的 (key, img_path, lbl_path), 如DataDirDT或ipath.get_dataset_pair的返回值
+        lmdb_dir: 输出目录, 已有num-samples时在其后追加
+        lbl_reader: lbl_path -> 标注字符串, 默认读取整个文本文件
+        check_mode: None 不检查; 'validate' 进程池解码, 跳过损坏图片; 'reencode' 同时重新编码为jpg
+        num_threads: 读文件的线程数
+        num_workers: check_mode 不为None时的进程数, None 为cpu数, 0 为在当前进程中检查
+        batch_size: 每个进程任务包含的样本数
+        quality: reencode 时的jpg质量
+        map_size: 初始map_size, 使用'write'预设, 空间不足时自动扩大
+        writer_kwargs: 见LMDBWriter, 如 commit_items / commit_bytes
+            image-/label- key交错写入, 不是按字节序递增, 不支持is_append
+    Returns:
+        本次写入的样本数
+    """
+    if check_mode not in [None, 'validate', 'reencode']:
+        raise NotImplementedError(f"check_mode 类型有误, 期望[None, 'validate', 'reencode'], 输入:{check_mode}")
+    if writer_kwargs.get('is_append'):
+        raise ValueError("build_lmdb 交错写入image-/label- key, 不能使用is_append")
+    locr = LMDB_OCR(lmdb_dir, map_size=map_size, profile='write')
+    start = locr.get_num_samples() or 0
+    idx, n_invalid = start, 0
+    read_func = partial(_read_sample, lbl_reader=lbl_reader)
+    with contextlib.ExitStack() as stack:
+        # 进程池先于读线程启动, 避免在已有线程的进程中fork
+        pex = None
+        if check_mode is not None and num_workers != 0:
+            pex = stack.enter_context(imultiproc.start_process_pool(num_workers))
+        tex = stack.enter_context(ThreadPoolExecutor(num_threads))
+        # 读文件 -> (可选)进程池检查 -> 单写者按批提交, 全程按pairs顺序流式处理
+        sample_iter = imultiproc.imap_ordered(tex, read_func, pairs, num_threads * 4)
+        if check_mode is not None:
+            check_func = partial(_check_sample_batch, check_mode=check_mode, quality=quality)
+            batch_iter = _iter_batch(sample_iter, batch_size)
+            if pex is None:
+                batch_iter = map(check_func, batch_iter)
+            else:
+                batch_iter = imultiproc.imap_ordered(pex, check_func, batch_iter)
+            sample_iter = (sample for batch in batch_iter for sample in batch)
+        with locr.writer(**writer_kwargs) as writer:
+            for key, imgbuf, lbl in sample_iter:
+                if imgbuf is None:
+                    n_invalid += 1
+                    print(f"图片损坏, 跳过: {key}")
+                    continue
+                idx += 1
+                writer.put(f"image-{idx:09d}", imgbuf)
+                writer.put(f"label-{idx:09d}", lbl)
+            writer.put(b'num-samples', str(idx))
+    print(f"构建完成: {lmdb_dir}, 新增: {idx - start}, 总数: {idx}, 损坏: {n_invalid}")
+    return idx - start
+
+
+def build_lmdb_shards(pairs, out_dir, num_shards, **kwargs):
+    """将pairs按下标交错分为num_shards份, 每份一个进程并行构建 out_dir/shard_%03d, 参数见build_lmdb
+    只使用这一个进程池, 各分片进程内直接检查图片(num_workers=0), 不再嵌套进程池
+    Returns:
+        [(shard_dir, 样本数)]
+    """
+    pairs = list(pairs)
+    os.makedirs(out_dir, exist_ok=True)
+    shard_dirs = [osp.join(out_dir, f"shard_{i:03d}") for i in range(num_shards)]
+    kwargs['num_workers'] = 0
+    with ProcessPoolExecutor(num_shards) as ex:
+        futures = [ex.submit(build_lmdb, pairs[i::num_shards], shard_dirs[i], **kwargs) for i in range(num_shards)]
+        return [(shard_dir, fut.result()) for shard_dir, fut in zip(shard_dirs, futures)]
+
+
+def __bench_decode(lmdb_dir, num=1000, reduce=1):
+    """对比 PIL(旧) 与 buffer+cv2/turbojpeg 解码的 samples/s"""
+    locr = LMDB_OCR(lmdb_dir, profile='read')
+    keys = list(locr.get_all(only_key=True, include='image'))[:num]
+
+    def _old(k):
+        # gen_img_lbl 中的旧路径: bytes -> BytesIO -> PIL -> np.array
+        return cv2.cvtColor(np.array(locr.get_img(k), dtype=np.uint8), cv2.COLOR_RGB2BGR)
+
+    bench_lis = [('pil', _old)]
+    for backend in ['cv2', 'turbojpeg']:
+        if backend == 'turbojpeg' and iimg._turbo_jpeg is None:
             continue
-            img = np.array(locr.get_img(k), dtype=np.uint8)
-            cv2.imwrite(osp.join(img_dir, f"{k}.jpg"), img)
-        if 'label' in k:
-            res_lis.append(f"{k.replace('label', 'image')}.jpg,{locr.get_lbl(k)}\n")
-    print(len(res_lis))
-    with open(osp.join(lbl_dir, 'labels.txt'), 'w') as f:
-        f.writelines(res_lis)
+        bench_lis.append((backend, partial(locr.get_img_arr, reduce=1, backend=backend)))
+        if reduce > 1:
+            bench_lis.append((f"{backend}_reduce{reduce}", partial(locr.get_img_arr, reduce=reduce, backend=backend)))
+    for name, func in bench_lis:
+        st = time.time()
+        for k in keys:
+            func(k)
+        used = max(time.time() - st, 1e-9)
+        print(f"{name:>16}: {len(keys)/used:.1f} samples/s")
+
+
+def _bench_read_worker(arg):
+    lmdb_dir, profile, keys = arg
+    locr = LMDB_OCR(lmdb_dir, profile=profile)
+    st = time.time()
+    for k in keys:
+        locr.get(k)
+    return time.time() - st
+
+
+def __bench_profiles(lmdb_dir, num=20000, num_readers_lis=(1, 4, 8), profiles=('default', 'read_shared', 'read')):
+    """多个读进程随机读取时不同预设的总吞吐量, 冷缓存(echo 3 > /proc/sys/vm/drop_caches)下readahead差异更明显"""
+    locr = LMDB_OCR(lmdb_dir, profile='read')
+    keys = locr.get_key_index('image').sample(num)
+    del locr    # 子进程中不能再打开同一个env
+    for num_readers in num_readers_lis:
+        for profile in profiles:
+            args = [(lmdb_dir, profile, keys[i::num_readers]) for i in range(num_readers)]
+            with ProcessPoolExecutor(num_readers) as ex:
+                used = max(ex.map(_bench_read_worker, args))
+            print(f"readers:{num_readers:>3} profile:{profile:>12}: {len(keys)/max(used, 1e-9):.1f} samples/s")
+
 
 def __test():
     lmdb_dir = '/code/ocr/ocr_pipeline/text_render/__data/eng_1M/train'
@@ -132,7 +1035,46 @@ def __test():
         cv2.imwrite(path, img)
 
 
+def __cli():
+    import argparse
+    parser = argparse.ArgumentParser(description='lmdb 维护工具')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('stat', help='env.stat/env.info 及空间利用率')
+    p.add_argument('lmdb_dir')
+    p = sub.add_parser('hist', help='key前缀直方图')
+    p.add_argument('lmdb_dir')
+    p.add_argument('--sep', default='-')
+    p = sub.add_parser('validate', help='多进程解码检查图片')
+    p.add_argument('lmdb_dir')
+    p.add_argument('--prefix', default='image')
+    p.add_argument('--num_workers', type=int, default=None)
+    p = sub.add_parser('compact', help='压缩拷贝')
+    p.add_argument('lmdb_dir')
+    p.add_argument('out_dir')
+    p = sub.add_parser('export', help='导出为 images/ 与 labels/labels.txt')
+    p.add_argument('lmdb_dir')
+    p.add_argument('out_dir')
+    p.add_argument('--num_workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.cmd == 'export':
+        gen_img_lbl(args.lmdb_dir, args.out_dir, num_workers=args.num_workers)
+        return
+    locr = LMDB_OCR(args.lmdb_dir, profile='read')
+    if args.cmd == 'stat':
+        for k, v in locr.get_stat().items():
+            print(f"{k:>16}: {v}")
+        print(f"{'num-samples':>16}: {locr.get_num_samples()}")
+    elif args.cmd == 'hist':
+        for k, v in sorted(locr.get_prefix_hist(sep=args.sep).items()):
+            print(f"{k:>16}: {v}")
+    elif args.cmd == 'validate':
+        for key in locr.validate_imgs(prefix=args.prefix, num_workers=args.num_workers):
+            print(key)
+    elif args.cmd == 'compact':
+        locr.compact(args.out_dir)
+
+
 if __name__ == '__main__':
-    lmdb_dir = '/code/ocr/ocr_pipeline/text_render/__data/eng_1M/train'
-    out_dir = '/data/ocr_dataset/localization/neolix/synthisis/'
-    gen_img_lbl(lmdb_dir, out_dir)
+    # python -m ibasis.ilmdb {stat,hist,validate,compact,export} lmdb_dir ...
+    __cli()
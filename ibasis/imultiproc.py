@@ -1,4 +1,9 @@
+import os
+import time
+import itertools
+from collections import deque
 from multiprocessing import Pool
+from concurrent.futures import ProcessPoolExecutor
 
 
 def multi_pool(func, args_lis):
@@ -22,3 +27,39 @@ def multi_pool(func, args_lis):
     p.join()
     return res_lis
 
+
+def imap_ordered(executor, func, iterable, max_pending=None):
+    """
+    边提交边按输入顺序返回结果, 同时最多有max_pending个任务未取走, 输入可以是很长的生成器
+    Args:
+        executor: ThreadPoolExecutor / ProcessPoolExecutor
+        func: 单参数函数, ProcessPoolExecutor时需可pickle
+        iterable: 参数迭代器
+        max_pending: 在途任务数, None 为 cpu数 * 2, 线程池的线程数与cpu数无关时应显式指定
+    Returns:
+        结果生成器
+    """
+    if max_pending is None:
+        max_pending = (os.cpu_count() or 1) * 2
+    it = iter(iterable)
+    futures = deque(executor.submit(func, arg) for arg in itertools.islice(it, max_pending))
+    while len(futures) > 0:
+        res = futures.popleft().result()
+        for arg in itertools.islice(it, 1):
+            futures.append(executor.submit(func, arg))
+        yield res
+
+
+def start_process_pool(max_workers=None, **kwargs):
+    """
+    创建ProcessPoolExecutor并立即启动全部子进程, 之后再在父进程中创建线程
+    避免在已有其他线程的进程中fork(子进程会继承被其他线程持有的锁, 可能死锁)
+    Args:
+        max_workers: 进程数, None 为cpu数
+        kwargs: 见ProcessPoolExecutor
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers, **kwargs)
+    # python3.9/3.10 按需启动子进程, 同时提交max_workers个短任务使其全部启动
+    list(executor.map(time.sleep, [0.01] * max_workers))
+    return executor
@@ -1,8 +1,10 @@
 import os
 import warnings
+import numpy as np
 import os.path as osp
 from pathlib import Path
-from . import ibasic
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 
 # Path Enhancement
@@ -20,6 +22,9 @@ class DisplayablePath(object):
     display_filename_prefix_last = '└──'
     display_parent_prefix_middle = '    '
     display_parent_prefix_last = '│   '
+    is_count_file = False
+    is_show_size = False
+    count_dic = dict()      # {normpath(dir): [递归文件数, 递归字节数]}, 由get_tree_stats一次算出
 
     def __init__(self, path, parent_path, is_last):
         self.path = Path(str(path))
@@ -37,8 +42,10 @@ class DisplayablePath(object):
     #     return self.path.name
 
     @classmethod
-    def make_tree(cls, root, parent=None, is_last=False, criteria=None, is_count_file=False):
+    def make_tree(cls, root, parent=None, is_last=False, criteria=None, is_count_file=False, count_dic=None):
         cls.is_count_file = is_count_file
+        if count_dic is not None:
+            cls.count_dic = count_dic
         root = Path(str(root))
         criteria = criteria or cls._default_criteria
 
@@ -69,11 +76,22 @@ class DisplayablePath(object):
         if self.path.is_dir():
             path = self.path.name + '/'
             if self.is_count_file:
-                path += '\t' + str(len(get_paths(str(self.path), key_mode=3, is_lis=True)))
+                n_files, n_bytes = self._get_count()
+                path += '\t' + str(n_files)
+                if self.is_show_size:
+                    path += '\t' + fmt_size(n_bytes)
             return path
 
         return self.path.name
 
+    def _get_count(self):
+        key = osp.normpath(str(self.path))
+        if key not in self.count_dic:
+            # 指向目录的软链接不会被get_tree_stats遍历, 单独统计
+            stats = get_tree_stats(str(self.path), is_size=self.is_show_size)
+            self.count_dic.update({osp.normpath(k): v for k, v in stats.items()})
+        return self.count_dic[key]
+
     def displayable(self):
         if self.parent is None:
             return self.displayname
@@ -95,11 +113,63 @@ class DisplayablePath(object):
         return ''.join(reversed(parts))
 
 
-def count_files_recursively(dir_):
-    total = 0
-    for root, dirs, files in os.walk(dir_):
-        total += len(files)
-    return total
+def _stat_dir_task(dir_, is_size=False):
+    """列出目录一次, 返回 ((dir_, 文件数, 字节数, 子目录), 子目录), 文件的分类与os.walk一致"""
+    n_files, n_bytes, sub_dirs = 0, 0, list()
+    try:
+        it = os.scandir(dir_)
+    except OSError:
+        return (dir_, n_files, n_bytes, sub_dirs), sub_dirs
+    with it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    sub_dirs.append(entry.path)
+                continue
+            n_files += 1
+            if is_size:
+                try:
+                    n_bytes += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    return (dir_, n_files, n_bytes, sub_dirs), sub_dirs
+
+
+def get_tree_stats(dir_, is_size=False, num_workers=None):
+    """一次遍历, 自底向上汇总每个目录(含所有子目录)的文件数和字节数
+    Args:
+        dir_: 根目录
+        is_size: 是否统计字节数, 需要对每个文件stat一次
+        num_workers: 线程数, 见walk_files
+    Returns:
+        {dir_path: [n_files, n_bytes]}, dir_path 与os.walk中的root写法一致
+    """
+    task = partial(_stat_dir_task, is_size=is_size)
+    records = list(_iter_preorder(task, dir_, num_workers))
+    stats = dict()
+    # 先序的逆序保证子目录先于父目录被汇总
+    for root, n_files, n_bytes, sub_dirs in reversed(records):
+        for d in sub_dirs:
+            n_files += stats[d][0]
+            n_bytes += stats[d][1]
+        stats[root] = [n_files, n_bytes]
+    return stats
+
+
+def count_files_recursively(dir_, num_workers=None):
+    return get_tree_stats(dir_, num_workers=num_workers)[dir_][0]
+
+
+def fmt_size(n_bytes):
+    """1536 -> '1.5K'"""
+    for unit in ['B', 'K', 'M', 'G', 'T']:
+        if n_bytes < 1024 or unit == 'T':
+            return f"{n_bytes:.0f}{unit}" if unit == 'B' else f"{n_bytes:.1f}{unit}"
+        n_bytes /= 1024
 
 
 def get_basename(path):
@@ -139,11 +209,17 @@ def make_path_dir(path, exist_ok=True):
         os.makedirs(pdir, exist_ok=exist_ok)
 
 
-def __speed(func, arg, K=1e6):
+def __speed(func, arg, K=1e6, is_batch=False):
+    """is_batch: func为批量版本, 以 [arg]*K 调用一次, 输出的per为单条耗时"""
     import time
-    st = time.time()
-    for i in range(int(K)):
-        func(arg)
+    if is_batch:
+        args = np.asarray([arg] * int(K))
+        st = time.time()
+        func(args)
+    else:
+        st = time.time()
+        for i in range(int(K)):
+            func(arg)
     end = time.time()
     used = end-st
     print(f"used:{used:.5f}, per:{used/K :5e}")
@@ -151,6 +227,146 @@ def __speed(func, arg, K=1e6):
 
 # === 功能函数 ===
 
+IMAGE_FILE_TYPE = ['.png', '.jpg', '.jpeg']
+
+
+def _scan_dir(dir_):
+    """列出目录一次, 返回 (dir_, 文件名列表, 子目录路径列表)
+    分类方式与os.walk一致: 指向目录的软链接算作目录(但不递归), 其余(含损坏的软链接)算作文件
+    """
+    names, sub_dirs = list(), list()
+    try:
+        it = os.scandir(dir_)
+    except OSError:
+        return dir_, names, sub_dirs
+    with it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                names.append(entry.name)
+            elif not entry.is_symlink():
+                sub_dirs.append(entry.path)
+    return dir_, names, sub_dirs
+
+
+def _shutdown_pool(ex, futures):
+    """取消尚未开始的任务后等待线程池退出 (shutdown的cancel_futures参数需要python>=3.9)"""
+    for fut in futures:
+        fut.cancel()
+    ex.shutdown(wait=True)
+
+
+def _iter_preorder(task, root, num_workers=None, max_pending=None):
+    """以先序遍历树, task(node) -> (result, children), 依次yield result
+    子节点一经发现即提交到线程池执行, 调用方按先序依次消费, num_workers=1 时为单线程
+    max_pending: 最多预取的节点数, None 不限制; 限制后内存中只保留max_pending个未消费的结果
+    """
+    if num_workers == 1:
+        stack = [root]
+        while stack:
+            result, children = task(stack.pop())
+            stack.extend(reversed(children))
+            yield result
+        return
+
+    ex = ThreadPoolExecutor(num_workers)
+    try:
+        stack = [[root, None]]      # [node, future], future为None表示尚未提交
+        n_pending = 0
+        while stack:
+            node, fut = stack.pop()
+            if fut is None:
+                fut = ex.submit(task, node)
+            else:
+                n_pending -= 1
+            result, children = fut.result()
+            stack.extend([c, None] for c in reversed(children))
+            # 从栈顶(即最先被消费的节点)开始预取
+            for item in reversed(stack):
+                if max_pending is not None and n_pending >= max_pending:
+                    break
+                if item[1] is None:
+                    item[1] = ex.submit(task, item[0])
+                    n_pending += 1
+                elif max_pending is None:
+                    break
+            yield result
+    finally:
+        _shutdown_pool(ex, [item[1] for item in stack if item[1] is not None])
+
+
+def _scan_dir_task(dir_):
+    root, names, sub_dirs = _scan_dir(dir_)
+    return (root, names), sub_dirs
+
+
+def walk_files(dir_, num_workers=None, max_pending=None):
+    """用os.scandir + 线程池遍历目录, 按os.walk(top-down)的顺序返回 (root, 文件名列表)
+    Args:
+        dir_: 根目录
+        num_workers: 线程数, None 使用ThreadPoolExecutor默认值, 1 为单线程
+        max_pending: 最多预取(已扫描未消费)的目录数, None 不限制
+    Note:
+        子目录一经发现即提交到线程池扫描, 调用方按先序依次消费, 因此顺序与os.walk完全一致
+    """
+    return _iter_preorder(_scan_dir_task, dir_, num_workers, max_pending)
+
+
+def _fmt_file_type(file_type):
+    if isinstance(file_type, str):
+        if file_type == 'IMAGE':
+            file_type = IMAGE_FILE_TYPE
+        else:
+            file_type = [file_type]
+    if file_type is not None:
+        file_type = set(file_type)
+    return file_type
+
+
+def _iter_key_path(dir_, walk_iter, file_type=None, key_mode=0, stem_append=None):
+    """将walk_iter给出的 (root, 文件名列表) 转为 (key, rel_path, abs_path), 规则同get_paths
+    每个目录只计算一次前缀, 每个文件只做一次splitext
+    """
+    if key_mode not in (0, 1, 2, 3, 4, 5):
+        raise NotImplementedError(f'key mode 类型有误, 期望[0,1,2,3,4,5], 输入:{key_mode}')
+    file_type = _fmt_file_type(file_type)
+    _replace_dir = dir_
+    if not _replace_dir.endswith('/'):
+        _replace_dir += '/'
+
+    for root, names in walk_iter:
+        root_prefix = osp.join(root, '')
+        rel_root = root_prefix.replace(_replace_dir, '')
+        # 仅在rel_root异常(被replace截断)时退回逐文件计算, 保证与原实现结果一致
+        is_fast = rel_root == '' or rel_root.endswith('/')
+        if key_mode in (4, 5):
+            idx = rel_root.rfind('/')
+            key_prefix = rel_root[rel_root.rfind('/', 0, idx) + 1:] if idx >= 0 else rel_root
+        for name in names:
+            stem, suffix = osp.splitext(name)
+            if file_type is not None and suffix.lower() not in file_type:
+                continue
+            rel_path = rel_root + name
+            if key_mode == 0:
+                key = stem
+            elif key_mode == 1:
+                key = name
+            elif key_mode == 3:
+                key = rel_path
+            elif key_mode == 5:
+                key = key_prefix + name
+            elif key_mode == 2:
+                key = rel_root + stem if is_fast else osp.splitext(rel_path)[0]
+            else:
+                key = key_prefix + stem if is_fast else osp.splitext(key_prefix + name)[0]
+            if stem_append is not None and key_mode in (0, 2, 4):
+                key = key.replace(stem_append, '')
+            yield key, rel_path, root_prefix + name
+
+
 def get_paths(dir_, 
               file_type=None, 
               key_mode=0, 
@@ -159,6 +375,8 @@ def get_paths(dir_,
               is_lis=False, 
               is_sort=False, 
               is_debug=False,
+              num_workers=None,
+              cache_dir=None,
               ):
     """
     获取一个目录下所有文件路径
@@ -168,6 +386,8 @@ def get_paths(dir_,
         key_mode: 0: stem, 1: name,  2: rel_stem, 3: rel_name
         stem_append: 在stem中过滤给出的字段, e.g. 'xxx.lines.jpg' stem_append='.lines' -> 'xxx'
         注意, 该字段需要在key_mode 为 0和2 才能执行
+        num_workers: 扫描目录的线程数, None 为默认值, 1 为单线程, 见walk_files
+        cache_dir: 不为None时使用磁盘路径索引缓存, 只重新列出mtime变化的目录, 见ipathcache
         e.g. path='/a/b/c/d.jpg', dir='/a'
         0: {'d': '/a/b/c/d.jpg'}
         1: {'d.jpg': '/a/b/c/d.jpg'}
@@ -179,58 +399,19 @@ def get_paths(dir_,
     Returns:
     # TODO: windows路径没有处理
     """
-    def rm_stem_append(input):
-        if stem_append is not None:
-            return input.replace(stem_append, '')
-        else:
-            return input
-
-    if isinstance(file_type, str):
-        if file_type == 'IMAGE':
-            file_type = ['.png', '.jpg', '.jpeg']
-        else:
-            file_type = [file_type]
-
+    if cache_dir is not None:
+        from . import ipathcache
+        return ipathcache.get_paths_cached(dir_, file_type=file_type, key_mode=key_mode, stem_append=stem_append,
+                                           is_rel=is_rel, is_lis=is_lis, is_sort=is_sort, is_debug=is_debug,
+                                           num_workers=num_workers, cache_dir=cache_dir)
     path_dic = dict()
-    _replace_dir = dir_
-    if not _replace_dir.endswith('/'):
-        _replace_dir += '/'
-    for root, dirs, name_lis in os.walk(dir_):
-        for name in name_lis:
-            stem, suffix = osp.splitext(name)
-            suffix = suffix.lower()
-            abs_path = osp.join(root, name)
-            rel_path = abs_path.replace(_replace_dir, '')
-            if file_type is not None and suffix not in file_type:
-                continue
-            if key_mode in [0, 1]:
-                key = name              # == 1
-                if key_mode == 0:
-                    key = rm_stem_append(stem)
-            elif key_mode in [2, 3]:
-                key = rel_path
-                if key_mode == 2:
-                    key = rm_stem_append(osp.splitext(key)[0])
-            elif key_mode in [4, 5]:
-                split_lis = rel_path.split('/')
-                if len(split_lis) <= 1:
-                    key = rel_path
-                    if key_mode == 4:
-                        key = rm_stem_append(osp.splitext(key)[0])
-                else:
-                    key = '/'.join(split_lis[-2:])
-                    if key_mode == 4:
-                        key = rm_stem_append(osp.splitext(key)[0])
-            else:
-                raise NotImplementedError(f'key mode 类型有误, 期望[0,1,2,3,4,5], 输入:{key_mode}')
-            if key in path_dic:
-                warnings.warn(f"Key: {key} exists on path_dic, will update old key, path: {abs_path}")
-            if is_rel:
-                path_dic[key] = rel_path
-            else:
-                path_dic[key] = abs_path
-            if is_debug:
-                print(key, path_dic[key])
+    walk_iter = walk_files(dir_, num_workers=num_workers)
+    for key, rel_path, abs_path in _iter_key_path(dir_, walk_iter, file_type, key_mode, stem_append):
+        if key in path_dic:
+            warnings.warn(f"Key: {key} exists on path_dic, will update old key, path: {abs_path}")
+        path_dic[key] = rel_path if is_rel else abs_path
+        if is_debug:
+            print(key, path_dic[key])
     if is_sort:
         path_dic = {k: path_dic[k] for k in sorted(path_dic.keys())}
     if is_lis:
@@ -238,13 +419,72 @@ def get_paths(dir_,
     return path_dic
 
 
-def get_dirs(dir_, max_level=1, is_abs=False):
+def iter_paths(dir_,
+               file_type=None,
+               key_mode=0,
+               stem_append=None,
+               is_rel=False,
+               dup_mode='warn',
+               dup_lis=None,
+               num_workers=None,
+               max_pending=64,
+               ):
+    """流式版本的get_paths, 边扫描边yield (key, path), 顺序与get_paths(is_sort=False)一致
+    Args:
+        dir_, file_type, key_mode, stem_append, is_rel: 同get_paths
+        dup_mode: 重复key处理方式, 仅保存每个key的hash(int)用于判重, 不保存路径字符串
+            None: 不检查
+            'warn': 告警, 仍然yield
+            'skip': 告警, 不再yield重复的key(保留第一个, 注意get_paths保留的是最后一个)
+        dup_lis: list, 不为None时将重复的key追加到其中, 便于遍历结束后汇总
+        max_pending: 最多预取的目录数, 控制内存上限, None 不限制
+    Note:
+        hash判重在千万级key下存在极小概率的误报
+    """
+    if dup_mode not in (None, 'warn', 'skip'):
+        raise NotImplementedError(f"dup_mode 类型有误, 期望[None, 'warn', 'skip'], 输入:{dup_mode}")
+    key_hash_set = set()
+    n_dup = 0
+    walk_iter = walk_files(dir_, num_workers=num_workers, max_pending=max_pending)
+    for key, rel_path, abs_path in _iter_key_path(dir_, walk_iter, file_type, key_mode, stem_append):
+        if dup_mode is not None:
+            h = hash(key)
+            if h in key_hash_set:
+                n_dup += 1
+                warnings.warn(f"Key: {key} already yielded, path: {abs_path}")
+                if dup_lis is not None:
+                    dup_lis.append(key)
+                if dup_mode == 'skip':
+                    continue
+            else:
+                key_hash_set.add(h)
+        yield key, rel_path if is_rel else abs_path
+    if n_dup > 0:
+        warnings.warn(f"Found {n_dup} duplicate keys on {dir_}")
+
+
+def _list_sub_dirs(dir_):
+    """列出目录下的子目录(含指向目录的软链接), 与 os.listdir + osp.isdir 的结果一致"""
+    sub_dirs = list()
+    with os.scandir(dir_) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                sub_dirs.append(entry.path)
+    return sub_dirs
+
+
+def get_dirs(dir_, max_level=1, is_abs=False, num_workers=None):
     """获取目录下所有子目录, 并以列表返回
     Args:
         dir_: ~
         max_level:
             0, 往下一级 +1
             -1, 递归遍历然后输出所有子目录
+        num_workers: 线程数, None 使用ThreadPoolExecutor默认值
     Return:
         list
     e.g.
@@ -267,32 +507,40 @@ def get_dirs(dir_, max_level=1, is_abs=False):
     >>> get_dir('root', 0)
     ['root']
     """
-    dirs = list()
-
-    def has_sub_dir(_dir):
-        for name in os.listdir(_dir):
-            if osp.isdir(osp.join(_dir, name)):
-                return True
-        return False
-    
-    cur_level = 0
-    def _get_dir(_dir, cur_level):
-        cnt = 0
-        if cur_level == max_level:
-            dirs.append(_dir)
-            return
-        for name in os.listdir(_dir):
-            uri = osp.join(_dir, name)
-            if osp.isdir(uri):
-                cnt += 1
-                if has_sub_dir(uri):
-                    _get_dir(uri, cur_level+1)
+    # 每个目录只列出一次, scandir的d_type判断目录不需要额外stat; 兄弟目录在线程池中并行列出
+    if max_level == 0:
+        dirs = [dir_]
+    else:
+        dirs, stack = list(), list()
+        ex = ThreadPoolExecutor(num_workers)
+        try:
+            def _expand(sub_dirs, level):
+                # sub_dirs 位于 level+1 层, 到达max_level的目录直接输出, 无需再列出
+                if level + 1 == max_level:
+                    items = [(d, None) for d in sub_dirs]
                 else:
-                    dirs.append(uri)
-        # To solve get_dir('root', 0) -> [] when root/ is empty or don't have subdir, expected -> ['root'] 
-        if cnt == 0:
-            dirs.append(_dir)
-    _get_dir(dir_, cur_level)
+                    items = [(d, ex.submit(_list_sub_dirs, d)) for d in sub_dirs]
+                return level, items, iter(items)
+
+            root_sub_dirs = _list_sub_dirs(dir_)
+            # To solve get_dir('root', 0) -> [] when root/ is empty or don't have subdir, expected -> ['root']
+            if len(root_sub_dirs) == 0:
+                dirs.append(dir_)
+            stack = [_expand(root_sub_dirs, 0)]
+            while stack:
+                level, _, it = stack[-1]
+                item = next(it, None)
+                if item is None:
+                    stack.pop()
+                    continue
+                d, fut = item
+                sub_dirs = fut.result() if fut is not None else None
+                if sub_dirs:
+                    stack.append(_expand(sub_dirs, level + 1))
+                else:
+                    dirs.append(d)
+        finally:
+            _shutdown_pool(ex, [fut for _, items, _ in stack for _, fut in items if fut is not None])
     if is_abs:
         dirs = [osp.abspath(d) for d in dirs]
     return dirs
@@ -305,18 +553,25 @@ def get_variable_name(variable):
 
 
 def get_dataset_pair(dir1, dir2, file_type1=None, file_type2=None, key_mode1=0, key_mode2=0,
-                     stem_append1=None, stem_append2=None, is_sort=True, is_lis=False):
+                     stem_append1=None, stem_append2=None, is_sort=True, is_lis=False, cache_dir=None):
+    """返回 [key, path1, path2], is_sort=True 时按key排序, False 时按dir1的遍历顺序"""
     print('获取路径下配对文件:')
     print('dir1:', dir1)
     print('dir2:', dir2)
-    img_path_dic = get_paths(dir1, file_type=file_type1, key_mode=key_mode1, stem_append=stem_append1)
-    lbl_path_dic = get_paths(dir2, file_type=file_type2, key_mode=key_mode2, stem_append=stem_append2)
-    inter_keys = ibasic.get_intersection_keys(img_path_dic, lbl_path_dic, is_sort=is_sort)
-    if is_lis:
-        return [[k, img_path_dic[k], lbl_path_dic[k]] for k in inter_keys]
+    img_path_dic = get_paths(dir1, file_type=file_type1, key_mode=key_mode1, stem_append=stem_append1,
+                             cache_dir=cache_dir)
+    lbl_path_dic = get_paths(dir2, file_type=file_type2, key_mode=key_mode2, stem_append=stem_append2,
+                             cache_dir=cache_dir)
+    # 按key配对, 结果按key有序
+    from . import ipathtable
+    pair = ipathtable.pair_tables(img_path_dic, lbl_path_dic)
+    if is_sort:
+        pair_iter = (list(p) for p in pair)
     else:
-        for key in inter_keys:
-            yield [key, img_path_dic.get(key), lbl_path_dic.get(key)]
+        pair_iter = ([k, p, lbl_path_dic[k]] for k, p in img_path_dic.items() if k in pair)
+    if is_lis:
+        return list(pair_iter)
+    return pair_iter
 
 
 def add_stemappend(path, stemappend='.lines', suffix=None):
@@ -356,17 +611,26 @@ def get_rel_path(path, dir_):
     return path.replace(dir_, '', 1)
 
 
-def pretty_print_dir(dir_, is_count_file=False):
+def pretty_print_dir(dir_, is_count_file=False, is_show_size=False, num_workers=None):
     """print
     Args:
         dir_dic:
+        is_count_file: 显示每个目录下(递归)的文件数
+        is_show_size: 显示每个目录下(递归)的文件大小, 需要is_count_file=True
+        num_workers: 统计时的线程数, 见get_tree_stats
     Returns:
     """
     # With a criteria (skip hidden files)
     def is_not_hidden(path):
         return not path.name.startswith(".") and not osp.isfile(path)
 
-    paths = DisplayablePath.make_tree(Path(dir_), criteria=is_not_hidden, is_count_file=is_count_file)
+    count_dic = None
+    DisplayablePath.is_show_size = is_show_size
+    if is_count_file:
+        stats = get_tree_stats(str(dir_), is_size=is_show_size, num_workers=num_workers)
+        count_dic = {osp.normpath(k): v for k, v in stats.items()}
+    paths = DisplayablePath.make_tree(Path(dir_), criteria=is_not_hidden, is_count_file=is_count_file,
+                                      count_dic=count_dic)
     for path in paths:
         print(path.displayable())
 
@@ -377,6 +641,75 @@ def change_path_suffix(path, suffix):
     return f"{osp.splitext(path)[0]}{suffix}"
 
 
+# === 批量版本, 输入序列或np字符串数组, 返回np数组, 结果与单条版本一致 ===
+
+def _to_str_arr(paths):
+    return np.asarray(paths, dtype=str)
+
+
+def _splitext_arr(paths):
+    """向量化的osp.splitext, 返回 (root, ext)"""
+    base = np.char.rpartition(paths, '/')[..., 2]
+    parts = np.char.rpartition(base, '.')
+    head, sep, tail = parts[..., 0], parts[..., 1], parts[..., 2]
+    # 与splitext一致: basename中最后一个'.'之前需要有非'.'字符, 如 '.bashrc' 没有后缀
+    has_ext = (sep == '.') & (np.char.lstrip(head, '.') != '')
+    root = np.where(has_ext, np.char.rpartition(paths, '.')[..., 0], paths)
+    ext = np.where(has_ext, np.char.add('.', tail), '')
+    return root, ext
+
+
+def get_stems(paths):
+    """批量get_stem"""
+    paths = _to_str_arr(paths)
+    if paths.size == 0:     # np.char 的部分函数不支持空数组
+        return paths
+    parts = np.char.rpartition(np.char.rpartition(paths, '/')[..., 2], '.')
+    return np.where(parts[..., 1] == '.', parts[..., 0], parts[..., 2])
+
+
+def get_suffixes(paths):
+    """批量get_suffix"""
+    paths = _to_str_arr(paths)
+    if paths.size == 0:
+        return paths
+    return _splitext_arr(paths)[1]
+
+
+def change_paths_suffix(paths, suffix):
+    """批量change_path_suffix"""
+    if not suffix.startswith('.'):
+        suffix = '.'+suffix
+    paths = _to_str_arr(paths)
+    if paths.size == 0:
+        return paths
+    return np.char.add(_splitext_arr(paths)[0], suffix)
+
+
+def splice_paths(routes, pdir, dst_dir=None, sep='__', is_reverse=False):
+    """批量splice"""
+    if dst_dir is None:
+        dst_dir = pdir
+    _pdir = pdir+'/' if not pdir.endswith('/') else pdir
+    routes = _to_str_arr(routes)
+    if routes.size == 0:
+        return routes
+    names = np.char.replace(np.char.replace(routes, _pdir, ''), '/', sep)
+    # osp.join(dst_dir, name)
+    prefix = dst_dir if (not dst_dir or dst_dir.endswith('/')) else dst_dir + '/'
+    return np.where(np.char.startswith(names, '/'), names, np.char.add(prefix, names))
+
+
+def get_rel_paths(paths, dir_):
+    """批量get_rel_path"""
+    if not dir_.endswith('/'):
+        dir_ += '/'
+    paths = _to_str_arr(paths)
+    if paths.size == 0:
+        return paths
+    return np.char.replace(paths, dir_, '', count=1)
+
+
 # === test func ===
 def __test_get_stem():
     __speed(get_stem, __test_unix_path)
@@ -384,6 +717,42 @@ def __test_get_stem():
     print(res)
 
 
+def __bench_get_paths(dir_, num_workers_lis=(1, 8, 32), cache_dir=None):
+    """对比os.walk与get_paths(scandir, 多线程, 可选缓存)的 files/sec, 同时校验结果一致"""
+    import time
+    st = time.time()
+    ref = sorted(osp.join(root, name) for root, _, names in os.walk(dir_) for name in names)
+    used = time.time() - st
+    print(f"os.walk     : {len(ref)} files, used:{used:.3f}s, {len(ref)/max(used, 1e-9):.0f} files/s")
+    # key_mode=3 相对路径作为key, 不会因重名丢失文件
+    bench_lis = [(f"scandir x{n:<3}", dict(num_workers=n)) for n in num_workers_lis]
+    if cache_dir is not None:
+        bench_lis += [('cache cold  ', dict(cache_dir=cache_dir)), ('cache warm  ', dict(cache_dir=cache_dir))]
+    for name, kwargs in bench_lis:
+        st = time.time()
+        res = get_paths(dir_, key_mode=3, is_lis=True, **kwargs)
+        used = time.time() - st
+        assert sorted(res) == ref, name
+        print(f"{name}: {len(res)} files, used:{used:.3f}s, {len(res)/max(used, 1e-9):.0f} files/s")
+
+
+def __test_batch_path_utils(K=1e6):
+    """批量版本与单条版本的一致性及耗时对比"""
+    cases = [
+        (get_stem, get_stems),
+        (get_suffix, get_suffixes),
+        (partial(change_path_suffix, suffix='png'), partial(change_paths_suffix, suffix='png')),
+        (partial(splice, pdir='/a/b'), partial(splice_paths, pdir='/a/b')),
+        (partial(get_rel_path, dir_='/a/b'), partial(get_rel_paths, dir_='/a/b')),
+    ]
+    paths = [__test_unix_path, 'a', '.bashrc', '/a/.b', '/a/..b', '/a.b/c', 'a.b.', '/a/b/c/d.jpg', '']
+    for func, batch_func in cases:
+        assert [func(p) for p in paths] == batch_func(paths).tolist(), func
+        print(getattr(func, 'func', func).__name__)
+        __speed(func, __test_unix_path, K)
+        __speed(batch_func, __test_unix_path, K, is_batch=True)
+
+
 def __test_splice():
     path = '/data16t/dataset/lanedet_online_dataset/tmp/2022-11-13_x3p96/meta/2022.11.13_10-44-01.992.json'
     new_path = '/data16t/dataset/lanedet_online_dataset/tmp/2022-11-13_x3p96_meta_2022.11.13_10-44-01.992.json'
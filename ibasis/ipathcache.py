@@ -0,0 +1,207 @@
+import os
+import time
+import pickle
+import hashlib
+import warnings
+import os.path as osp
+
+from . import ipath
+
+
+# 目录路径索引的磁盘缓存
+# 以 (根目录, file_type, key_mode, stem_append) 为键, 保存每个目录的 mtime / 子目录 / 文件key
+# 刷新时每个目录只做一次stat, 仅重新列出mtime发生变化的目录
+
+DEFAULT_CACHE_DIR = osp.join(osp.expanduser('~'), '.cache', 'ibasis', 'path_index')
+
+_MAGIC = b'IBPIDX01'
+_SEP = '\0'             # 文件名中不可能出现
+_RACY_NS = 2 * 10**9    # 扫描时刚被修改过的目录, mtime可能不可靠, 下次强制重新扫描
+
+
+def _encode(lis):
+    return _SEP.join(lis).encode('utf-8', 'surrogateescape')
+
+
+def _decode(blob, n):
+    if n == 0:
+        return []
+    return blob.decode('utf-8', 'surrogateescape').split(_SEP)
+
+
+def _split(lis, counts):
+    res, st = list(), 0
+    for n in counts:
+        res.append(lis[st:st+n])
+        st += n
+    return res
+
+
+class PathIndexCache:
+    def __init__(self, dir_, file_type=None, key_mode=0, stem_append=None, cache_dir=None):
+        """
+        Args:
+            dir_: 根目录
+            file_type, key_mode, stem_append: 同ipath.get_paths
+            cache_dir: 缓存文件目录, 默认 ~/.cache/ibasis/path_index
+        内存结构:
+            _dir_dic: {rel_dir: [mtime_ns, keys, files, sub_names]}
+                files 为文件相对dir_的路径, sub_names 为子目录名(有序)
+            _order: 先序排列的rel_dir, 与os.walk顺序一致
+        """
+        self.dir_ = dir_
+        self.file_type = ipath._fmt_file_type(file_type)
+        self.key_mode = key_mode
+        self.stem_append = stem_append
+        self.cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        self._prefix = osp.join(dir_, '')
+        self._dir_dic = dict()
+        self._order = list()
+        self.is_changed = False
+
+    @property
+    def cache_path(self):
+        params = repr((self.dir_, osp.abspath(self.dir_),
+                       sorted(self.file_type) if self.file_type is not None else None,
+                       self.key_mode, self.stem_append))
+        name = hashlib.md5(params.encode('utf-8', 'surrogateescape')).hexdigest()
+        return osp.join(self.cache_dir, f"{name}.pidx")
+
+    def __len__(self):
+        return sum(len(self._dir_dic[d][1]) for d in self._order)
+
+    def _root(self, rel_dir):
+        return osp.join(self.dir_, rel_dir) if rel_dir else self.dir_
+
+    def load(self):
+        """读取缓存文件, 不存在或格式不符时保持为空"""
+        path = self.cache_path
+        if not osp.exists(path):
+            return self
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(_MAGIC)) != _MAGIC:
+                    raise ValueError(f"Unknown path index format: {path}")
+                data = pickle.load(f)
+        except Exception as e:
+            warnings.warn(f"Load path index cache failed, will rebuild: {path}, {e}")
+            return self
+        n_files, n_subs = data['n_files'], data['n_subs']
+        self._order = _decode(data['dirs'], len(n_files))
+        keys = _split(_decode(data['keys'], sum(n_files)), n_files)
+        files = _split(_decode(data['files'], sum(n_files)), n_files)
+        subs = _split(_decode(data['subs'], sum(n_subs)), n_subs)
+        self._dir_dic = {d: [m, k, f, s] for d, m, k, f, s in zip(self._order, data['mtimes'], keys, files, subs)}
+        return self
+
+    def save(self):
+        entries = [self._dir_dic[d] for d in self._order]
+        data = {
+            'dirs': _encode(self._order),
+            'mtimes': [e[0] for e in entries],
+            'n_files': [len(e[1]) for e in entries],
+            'n_subs': [len(e[3]) for e in entries],
+            'keys': _encode([k for e in entries for k in e[1]]),
+            'files': _encode([f for e in entries for f in e[2]]),
+            'subs': _encode([s for e in entries for s in e[3]]),
+        }
+        path = self.cache_path
+        ipath.make_dirs(self.cache_dir)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_MAGIC)
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.is_changed = False
+        return self
+
+    def _refresh_dir(self, rel_dir):
+        """stat目录, mtime未变化直接复用缓存, 否则重新列出"""
+        root = self._root(rel_dir)
+        old = self._dir_dic.get(rel_dir)
+        try:
+            mtime = os.stat(root).st_mtime_ns
+        except OSError:
+            mtime = None
+        if old is not None and mtime is not None and old[0] == mtime:
+            entry, is_scanned = old, False
+        else:
+            _, names, sub_dirs = ipath._scan_dir(root)
+            keys, files = list(), list()
+            for key, _, abs_path in ipath._iter_key_path(self.dir_, [(root, names)], self.file_type,
+                                                         self.key_mode, self.stem_append):
+                keys.append(key)
+                files.append(abs_path[len(self._prefix):])
+            if mtime is None or time.time_ns() - mtime < _RACY_NS:
+                mtime = -1
+            entry, is_scanned = [mtime, keys, files, [osp.basename(d) for d in sub_dirs]], True
+        children = [osp.join(rel_dir, name) for name in entry[3]]
+        return (rel_dir, entry, is_scanned), children
+
+    def refresh(self, num_workers=None):
+        """按先序遍历目录树, 只重新列出mtime变化的目录"""
+        dir_dic, order, n_scanned = dict(), list(), 0
+        for rel_dir, entry, is_scanned in ipath._iter_preorder(self._refresh_dir, '', num_workers):
+            dir_dic[rel_dir] = entry
+            order.append(rel_dir)
+            n_scanned += is_scanned
+        if n_scanned > 0 or order != self._order:
+            self.is_changed = True
+        self._dir_dic, self._order = dir_dic, order
+        return self
+
+    def iter_key_path(self, is_rel=False):
+        """按os.walk顺序yield (key, path)"""
+        _replace_dir = self._prefix
+        for rel_dir in self._order:
+            _, keys, files, _ = self._dir_dic[rel_dir]
+            for key, f in zip(keys, files):
+                if is_rel:
+                    # 与get_paths的str.replace语义保持一致
+                    path = f.replace(_replace_dir, '') if _replace_dir in f else f
+                else:
+                    path = self._prefix + f
+                yield key, path
+
+    def get_paths(self, is_rel=False, is_lis=False, is_sort=False, is_debug=False):
+        """返回值与ipath.get_paths一致"""
+        path_dic = dict(self.iter_key_path(is_rel))
+        if is_debug or len(path_dic) != len(self):
+            # 存在重复key, 逐个插入以给出与get_paths相同的告警
+            path_dic = dict()
+            for key, path in self.iter_key_path(is_rel):
+                if key in path_dic:
+                    warnings.warn(f"Key: {key} exists on path_dic, will update old key, path: {path}")
+                path_dic[key] = path
+                if is_debug:
+                    print(key, path)
+        if is_sort:
+            path_dic = {k: path_dic[k] for k in sorted(path_dic.keys())}
+        if is_lis:
+            return list(path_dic.values())
+        return path_dic
+
+
+def get_paths_cached(dir_,
+                     file_type=None,
+                     key_mode=0,
+                     stem_append=None,
+                     is_rel=False,
+                     is_lis=False,
+                     is_sort=False,
+                     is_debug=False,
+                     num_workers=None,
+                     cache_dir=None,
+                     is_refresh=True,
+                     ):
+    """带磁盘缓存的get_paths, 参数及返回值同ipath.get_paths
+    Args:
+        cache_dir: 缓存目录, None 为默认目录
+        is_refresh: True 按目录mtime增量刷新; False 直接信任已有缓存(只读数据集), 缓存不存在时仍会全量扫描
+    """
+    cache = PathIndexCache(dir_, file_type, key_mode, stem_append, cache_dir).load()
+    if is_refresh or len(cache._order) == 0:
+        cache.refresh(num_workers)
+        if cache.is_changed:
+            cache.save()
+    return cache.get_paths(is_rel=is_rel, is_lis=is_lis, is_sort=is_sort, is_debug=is_debug)
@@ -0,0 +1,283 @@
+import zlib
+import warnings
+import numpy as np
+import os.path as osp
+from collections.abc import Mapping, ItemsView, ValuesView
+
+from . import ipath
+
+
+# 大数据集下替代 {key: path} 字典的紧凑路径表
+# key 与相对路径分别拼接存放在一块连续的bytes中, 以offset数组索引, 根目录只存一份
+# 按key的crc32分桶, 支持O(1)的key查询; 按下标O(1)访问; 按key有序迭代
+# 全部成员为bytes/np.ndarray, pickle时只是几块连续内存, 适合传给DataLoader workers
+
+
+def _encode(s):
+    return s.encode('utf-8', 'surrogateescape')
+
+
+def _decode(b):
+    return b.decode('utf-8', 'surrogateescape')
+
+
+def _pack(bytes_lis):
+    off = np.zeros(len(bytes_lis) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in bytes_lis], out=off[1:])
+    return b''.join(bytes_lis), off
+
+
+class _ItemsView(ItemsView):
+    def __iter__(self):
+        for i in range(len(self._mapping)):
+            yield self._mapping.get_item(i)
+
+
+class _ValuesView(ValuesView):
+    def __iter__(self):
+        for i in range(len(self._mapping)):
+            yield self._mapping.get_path(i)
+
+
+class PathTable(Mapping):
+    def __init__(self, root, keys, rel_paths, is_rel=False):
+        """
+        Args:
+            root: 根目录, 绝对路径 = osp.join(root, '') + rel_path
+            keys: key列表(str), 不可重复
+            rel_paths: 与keys对应的相对路径列表(str)
+            is_rel: True 时 table[key] 返回相对路径, 与get_paths(is_rel=True)对应
+        Note:
+            条目按key排序存放, 下标i即第i小的key
+        """
+        self.root = osp.join(root, '')
+        self.is_rel = is_rel
+        keys_b = [_encode(k) for k in keys]
+        rels_b = [_encode(p) for p in rel_paths]
+        if len(keys_b) != len(rels_b):
+            raise ValueError(f"Length of keys({len(keys_b)}) != length of rel_paths({len(rels_b)})")
+        order = sorted(range(len(keys_b)), key=keys_b.__getitem__)
+        keys_b = [keys_b[i] for i in order]
+        rels_b = [rels_b[i] for i in order]
+        for i in range(1, len(keys_b)):
+            if keys_b[i] == keys_b[i-1]:
+                raise ValueError(f"Duplicate key: {_decode(keys_b[i])}")
+        self._key_buf, self._key_off = _pack(keys_b)
+        self._rel_buf, self._rel_off = _pack(rels_b)
+        self._build_index(keys_b)
+
+    def _build_index(self, keys_b):
+        n = len(keys_b)
+        n_bucket = 1 << max(n - 1, 0).bit_length()
+        hashes = np.fromiter((zlib.crc32(b) for b in keys_b), dtype=np.uint32, count=n)
+        bucket = (hashes & np.uint32(n_bucket - 1)).astype(np.int64)
+        order = np.argsort(bucket, kind='stable')
+        self._bucket_mask = n_bucket - 1
+        self._bucket_order = order.astype(np.uint32 if n < 2**32 else np.int64)
+        self._bucket_start = np.searchsorted(bucket[order], np.arange(n_bucket + 1)).astype(np.int64)
+
+    @classmethod
+    def from_dict(cls, path_dic, root, is_rel=False):
+        """由get_paths返回的字典构造, is_rel 需与调用get_paths时一致"""
+        prefix = osp.join(root, '')
+        rel_paths = list()
+        for path in path_dic.values():
+            if not is_rel:
+                if not path.startswith(prefix):
+                    raise ValueError(f"Path: {path} is not under root: {root}")
+                path = path[len(prefix):]
+            rel_paths.append(path)
+        return cls(root, list(path_dic.keys()), rel_paths, is_rel=is_rel)
+
+    @classmethod
+    def from_dir(cls, dir_, file_type=None, key_mode=0, stem_append=None, is_rel=False,
+                 num_workers=None, cache_dir=None):
+        """扫描目录构造, 参数同get_paths; 重复key与get_paths一致保留最后一个"""
+        if cache_dir is not None:
+            # get_paths返回绝对路径, 表内只存相对路径, is_rel只决定取值时的形式
+            path_dic = ipath.get_paths(dir_, file_type=file_type, key_mode=key_mode, stem_append=stem_append,
+                                       num_workers=num_workers, cache_dir=cache_dir)
+            table = cls.from_dict(path_dic, dir_, is_rel=False)
+            table.is_rel = is_rel
+            return table
+        prefix = osp.join(dir_, '')
+        keys, rel_paths = list(), list()
+        walk_iter = ipath.walk_files(dir_, num_workers=num_workers)
+        for key, _, abs_path in ipath._iter_key_path(dir_, walk_iter, file_type, key_mode, stem_append):
+            keys.append(key)
+            rel_paths.append(abs_path[len(prefix):])
+        # 去重, 保留最后一个
+        if len(set(keys)) != len(keys):
+            idx_dic = {k: i for i, k in enumerate(keys)}
+            warnings.warn(f"Found {len(keys) - len(idx_dic)} duplicate keys on {dir_}, keep the last one")
+            keys = [keys[i] for i in idx_dic.values()]
+            rel_paths = [rel_paths[i] for i in idx_dic.values()]
+        return cls(dir_, keys, rel_paths, is_rel=is_rel)
+
+    # === 按下标访问 ===
+    def get_key(self, idx):
+        return _decode(self._get_key_b(idx))
+
+    def _get_key_b(self, idx):
+        return self._key_buf[self._key_off.item(idx):self._key_off.item(idx + 1)]
+
+    def get_rel_path(self, idx):
+        st, ed = self._rel_off[idx:idx+2].tolist()
+        return _decode(self._rel_buf[st:ed])
+
+    def get_path(self, idx):
+        """返回值与get_paths一致: is_rel=True 为相对路径, 否则为绝对路径"""
+        rel_path = self.get_rel_path(idx)
+        return rel_path if self.is_rel else self.root + rel_path
+
+    def get_item(self, idx):
+        return self.get_key(idx), self.get_path(idx)
+
+    # === 按key访问 ===
+    def index(self, key, default=-1):
+        """key -> 下标, 不存在时返回default"""
+        return self._index_b(_encode(key), default)
+
+    def _index_b(self, key_b, default=-1):
+        # ndarray.item 取单个元素比切片后tolist快, 配对时每个key都会调用
+        h = zlib.crc32(key_b) & self._bucket_mask
+        key_buf, key_off, order = self._key_buf, self._key_off, self._bucket_order
+        for j in range(self._bucket_start.item(h), self._bucket_start.item(h + 1)):
+            i = order.item(j)
+            if key_buf[key_off.item(i):key_off.item(i + 1)] == key_b:
+                return i
+        return default
+
+    def __getitem__(self, key):
+        idx = self.index(key)
+        if idx < 0:
+            raise KeyError(key)
+        return self.get_path(idx)
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self.index(key) >= 0
+
+    def __len__(self):
+        return len(self._key_off) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get_key(i)
+
+    def items(self):
+        return _ItemsView(self)
+
+    def values(self):
+        return _ValuesView(self)
+
+    def key_array(self):
+        """所有key组成的np.bytes_数组(有序, utf-8), 用于批量运算
+        Note:
+            np.bytes_为定长数组, 占用 len(self) * 最长key字节数, key长度差异大时远大于nbytes(),
+            配对(pair_tables)不使用该数组
+        """
+        return np.array([self._key_buf[self._key_off[i]:self._key_off[i+1]] for i in range(len(self))],
+                        dtype=np.bytes_)
+
+    def nbytes(self):
+        """占用内存(字节), 不含Python对象头"""
+        return (len(self._key_buf) + len(self._rel_buf) + self._key_off.nbytes + self._rel_off.nbytes
+                + self._bucket_order.nbytes + self._bucket_start.nbytes)
+
+    def __repr__(self):
+        return f"PathTable(root={self.root!r}, len={len(self)}, nbytes={self.nbytes()})"
+
+
+def _sorted_view(path_map):
+    """返回 (条数, idx->key, idx->path, (key, default)->idx), 下标均为按key有序后的下标
+    PathTable本身有序, 直接使用其方法; 字典只对key的引用排序, 不复制key
+    (str排序与utf-8字节序一致, 仅surrogateescape得到的非法字节除外)
+    """
+    if isinstance(path_map, PathTable):
+        return len(path_map), path_map.get_key, path_map.get_path, path_map.index
+    key_lis = sorted(path_map)
+    values = [path_map[k] for k in key_lis]
+    return len(key_lis), key_lis.__getitem__, values.__getitem__, dict(zip(key_lis, range(len(key_lis)))).get
+
+
+def _probe_join(n, get_key, index):
+    """按顺序用左侧第i个key在右侧查找(右侧为PathTable时为crc32分桶, O(1)), 返回 (左侧匹配的下标, 右侧匹配的下标)
+    只产生定长的int64数组, 不构造np.bytes_数组(占用 条数*最长key字节数)
+    """
+    pos = np.fromiter((index(get_key(i), -1) for i in range(n)), dtype=np.int64, count=n)
+    idx = np.flatnonzero(pos >= 0)
+    return idx, pos[idx]
+
+
+class PairTable:
+    def __init__(self, img_map, lbl_map, is_verbose=True):
+        """按key对img/lbl两组路径配对, 得到按key有序、下标对齐的 (key, img_path, lbl_path) 表
+        Args:
+            img_map, lbl_map: PathTable 或 get_paths 返回的字典
+        Attributes:
+            img_idx, lbl_idx: 第i个配对在两侧(按key排序后)的下标
+            only_img_idx, only_lbl_idx: 仅存在于一侧的下标, 见only_img_keys/only_lbl_keys
+        Note:
+            成员均为数组/PathTable/list的绑定方法, 可直接pickle传给DataLoader workers,
+            传入PathTable时pickle后只有几块连续内存
+        """
+        n_img, self._img_key, self._img_path, self._img_index = _sorted_view(img_map)
+        n_lbl, self._lbl_key, self._lbl_path, lbl_index = _sorted_view(lbl_map)
+        if isinstance(img_map, PathTable) and isinstance(lbl_map, PathTable):
+            # 两侧均为PathTable时直接比较utf-8 bytes, 省去解码/编码
+            self.img_idx, self.lbl_idx = _probe_join(n_img, img_map._get_key_b, lbl_map._index_b)
+        else:
+            self.img_idx, self.lbl_idx = _probe_join(n_img, self._img_key, lbl_index)
+        # img侧下标 -> 配对下标, 不在交集中为-1
+        self._img_pos = np.full(n_img, -1, dtype=np.int64)
+        self._img_pos[self.img_idx] = np.arange(len(self.img_idx))
+        self.only_img_idx = self._complement(self.img_idx, n_img)
+        self.only_lbl_idx = self._complement(self.lbl_idx, n_lbl)
+        if is_verbose:
+            print(f"dict:0={n_img} dict:1={n_lbl} inters={len(self)}")
+
+    @staticmethod
+    def _complement(idx, n):
+        mask = np.ones(n, dtype=bool)
+        mask[idx] = False
+        return np.flatnonzero(mask)
+
+    def __len__(self):
+        return len(self.img_idx)
+
+    def get_key(self, idx):
+        return self._img_key(int(self.img_idx[idx]))
+
+    def index(self, key, default=-1):
+        """key -> 配对下标, O(1), 不在交集中时返回default"""
+        img_i = self._img_index(key, -1)
+        if img_i < 0:
+            return default
+        idx = int(self._img_pos[img_i])
+        return idx if idx >= 0 else default
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self.index(key) >= 0
+
+    def __getitem__(self, idx):
+        """idx -> (key, img_path, lbl_path)"""
+        img_i, lbl_i = int(self.img_idx[idx]), int(self.lbl_idx[idx])
+        return self._img_key(img_i), self._img_path(img_i), self._lbl_path(lbl_i)
+
+    def __iter__(self):
+        for img_i, lbl_i in zip(self.img_idx.tolist(), self.lbl_idx.tolist()):
+            yield self._img_key(img_i), self._img_path(img_i), self._lbl_path(lbl_i)
+
+    def keys(self):
+        return [self._img_key(i) for i in self.img_idx.tolist()]
+
+    def only_img_keys(self):
+        return [self._img_key(i) for i in self.only_img_idx.tolist()]
+
+    def only_lbl_keys(self):
+        return [self._lbl_key(i) for i in self.only_lbl_idx.tolist()]
+
+
+def pair_tables(img_map, lbl_map, is_verbose=True):
+    """批量配对两组路径, 代替get_intersection_keys + sorted + 逐key查字典, 见PairTable"""
+    return PairTable(img_map, lbl_map, is_verbose=is_verbose)
@@ -0,0 +1,66 @@
+import json
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+idtbs = pytest.importorskip('busi.idtbs')
+
+
+def _make_dataset(pdir, num=4, bad_idx=None):
+    for sub in ['images/a', 'labels/a']:
+        (pdir / sub).mkdir(parents=True, exist_ok=True)
+    lbl = {'label': [{'pts': [[1, 1], [20, 1], [20, 20], [1, 20]], 'txt': 'a'},
+                     {'pts': [[10, 10], [30, 10], [30, 30], [10, 30]], 'txt': 'b'}]}
+    for i in range(num):
+        img_path = pdir / 'images' / 'a' / f"x{i}.jpg"
+        if i == bad_idx:
+            img_path.write_bytes(b'bad')
+        else:
+            cv2.imwrite(str(img_path), np.zeros((40 + i, 60, 3), dtype=np.uint8))
+        (pdir / 'labels' / 'a' / f"x{i}.json").write_text(json.dumps(lbl))
+    dataset = idtbs.ImageDataset().init_pdir(str(pdir))
+    dataset.init_bef_call_methods()
+    return dataset
+
+
+def test_gen_msk(tmp_path, capsys, monkeypatch):
+    from ibasis import iimgmeta
+    monkeypatch.setattr(iimgmeta, 'IMG_META_CACHE_DIR', str(tmp_path / 'cache'))
+    dataset = _make_dataset(tmp_path)
+    dataset.gen_msk(num_workers=2, chunksize=2)
+    assert 'done:4, skip:0, fail:0' in capsys.readouterr().out
+    msk = Image.open(tmp_path / 'masks' / 'a' / 'x3.png')
+    arr = np.array(msk)
+    assert msk.mode == 'P' and arr.shape == (43, 60)
+    # 重叠的两个多边形都被填充, 不会按奇偶规则挖空
+    assert arr[15, 15] == 1 and arr[5, 5] == 1 and arr[25, 25] == 1 and arr[35, 35] == 0
+
+    # 标注未变化时跳过, 标注更新后只重新生成对应的掩码
+    dataset.gen_msk(num_workers=2, chunksize=2)
+    assert 'done:0, skip:4, fail:0' in capsys.readouterr().out
+    lbl_path = tmp_path / 'labels' / 'a' / 'x1.json'
+    st = os.stat(lbl_path)
+    os.utime(lbl_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    dataset.gen_msk(num_workers=2, chunksize=2)
+    assert 'done:1, skip:3, fail:0' in capsys.readouterr().out
+
+
+def test_vis(tmp_path, capsys):
+    dataset = _make_dataset(tmp_path, bad_idx=2)
+    assert dataset.vis_lbl_on_img('a/x1') is True
+    assert dataset.vis_lbl_on_img('a/x2') is False
+    assert 'Vis failed!' in capsys.readouterr().out
+
+    fail_lis = dataset.vis_batch(num_workers=2)
+    assert [p for p, _ in fail_lis] == [str(tmp_path / 'images' / 'a' / 'x2.jpg')]
+    assert 'failed: 1' in capsys.readouterr().out
+    assert sorted(os.listdir(tmp_path / 'vis' / 'a')) == ['x0.jpg', 'x1.jpg', 'x3.jpg']
+
+    fail_lis = dataset.vis_batch(num_workers=2, grid=(2, 2), thumb_size=(32, 32))
+    assert len(fail_lis) == 1
+    sheet = cv2.imread(str(tmp_path / 'vis' / 'sheets' / 'sheet_00000.jpg'))
+    assert sheet.shape == (64, 64, 3)
+    assert (tmp_path / 'vis' / 'sheets' / 'sheets.txt').read_text().splitlines()[2] == 'sheet_00000.jpg\t2\ta/x2'
@@ -0,0 +1,50 @@
+import os
+import hashlib
+
+from ibasis import idedup, iserialization
+
+
+def _make_tree(root):
+    files = {
+        'a/x1.jpg': b'A' * 100, 'b/x1_copy.jpg': b'A' * 100,
+        'a/x2.jpg': b'B' * 100,                              # 大小相同内容不同
+        'a/big.jpg': b'C' * 50 + b'D' * 1000 + b'C' * 50,
+        'c/big_copy.jpg': b'C' * 50 + b'D' * 1000 + b'C' * 50,
+        'c/big_mid.jpg': b'C' * 50 + b'E' * 1000 + b'C' * 50,  # 头尾相同中间不同
+        'a/note.txt': b'A' * 100,
+    }
+    for rel, data in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    os.link(root / 'a' / 'x2.jpg', root / 'c' / 'x2_link.jpg')
+
+
+def test_find_dup_files(tmp_path):
+    tree = tmp_path / 'tree'
+    _make_tree(tree)
+    cache_path = str(tmp_path / 'cache.pkl')
+    ref = [[str(tree / 'a' / 'big.jpg'), str(tree / 'c' / 'big_copy.jpg')],
+           [str(tree / 'a' / 'x1.jpg'), str(tree / 'b' / 'x1_copy.jpg')],
+           [str(tree / 'a' / 'x2.jpg'), str(tree / 'c' / 'x2_link.jpg')]]
+    index = idedup.DedupIndex(str(tree), partial_size=16, cache_path=cache_path).build()
+    assert index.groups == ref
+    assert index.get_dup_paths() == {ref[0][1], ref[1][1], ref[2][1]}
+    # 命中缓存时结果不变; partial_size不同时缓存失效
+    assert idedup.DedupIndex(str(tree), partial_size=16, cache_path=cache_path).build().groups == ref
+    assert idedup.find_dup_files(str(tree), cache_path=cache_path) == ref
+
+
+def test_cache_algo_mismatch(tmp_path, monkeypatch):
+    tree = tmp_path / 'tree'
+    _make_tree(tree)
+    cache_path = str(tmp_path / 'cache.pkl')
+    idedup.DedupIndex(str(tree), partial_size=16, cache_path=cache_path).build()
+    # 换用另一种hash算法后新增一个副本: 旧缓存中的hash不能与新算法的hash混用
+    (tree / 'b' / 'x1_copy2.jpg').write_bytes(b'A' * 100)
+    monkeypatch.setattr(idedup, 'HASH_ALGO', 'md5_test')
+    monkeypatch.setattr(idedup, '_new_hasher', hashlib.md5)
+    groups = idedup.DedupIndex(str(tree), partial_size=16, cache_path=cache_path).build().groups
+    assert str(tree / 'b' / 'x1_copy2.jpg') in groups[1] and len(groups[1]) == 3
+    assert iserialization.load_pkl(cache_path)['algo'] == 'md5_test'
+    assert idedup.DedupIndex(str(tree)).cache_path.endswith('_md5_test.pkl')
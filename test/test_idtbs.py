@@ -0,0 +1,52 @@
+import pickle
+
+import pytest
+
+from loguru import logger
+
+from ibasis.idtbs import DataDirDT
+
+
+def _make_dataset(pdir):
+    for name in ['a/x1', 'a/x2', 'a/x3', 'b/y1']:
+        (pdir / 'images' / name).parent.mkdir(parents=True, exist_ok=True)
+        (pdir / 'images' / f"{name}.jpg").touch()
+    for name in ['a/x2', 'a/x3', 'b/y1', 'b/y2']:
+        (pdir / 'labels' / name).parent.mkdir(parents=True, exist_ok=True)
+        (pdir / 'labels' / f"{name}.json").touch()
+
+
+def test_uninit_introspection(tmp_path):
+    msgs = list()
+    sink_id = logger.add(msgs.append, level='ERROR')
+    try:
+        dd = DataDirDT().init_pdir(str(tmp_path))
+        str(dd)
+    finally:
+        logger.remove(sink_id)
+    assert msgs == []
+    assert bool(dd) is True
+    assert len(dd) == 0
+    assert dd.get_nums() == (0, 0, 0)
+
+
+@pytest.mark.parametrize('backend', ['dict', 'table'])
+def test_map_style(tmp_path, backend):
+    _make_dataset(tmp_path)
+    dd = DataDirDT(backend=backend).init_pdir(str(tmp_path))
+    dd.init_bef_call_methods()
+    assert len(dd) == 3 and bool(dd)
+    assert dd.get_nums() == (4, 4, 3)
+    assert dd.get_inter_keys() == ['a/x2', 'a/x3', 'b/y1']
+    assert dd.index('a/x3') == 1 and dd.index('a/x1') == -1
+    key, img_path, lbl_path = dd['b/y1']
+    assert (key, img_path, lbl_path) == dd[2]
+    assert img_path == str(tmp_path / 'images' / 'b' / 'y1.jpg')
+    assert lbl_path == str(tmp_path / 'labels' / 'b' / 'y1.json')
+    assert dd.get_data_pair('a/x1') == (None, None, None)
+    with pytest.raises(KeyError):
+        dd['a/x1']
+
+    dd2 = pickle.loads(pickle.dumps(dd))
+    assert not hasattr(dd2, 'img_path_dic')
+    assert [dd2[i] for i in range(len(dd2))] == [tuple(x) for x in dd]
@@ -0,0 +1,47 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+from ibasis import ifile
+
+
+def _make_tree(root):
+    for rel in ['a/x1.jpg', 'a/x2.png', 'b/y1.jpg']:
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(rel.encode())
+
+
+def test_migrate_journal(tmp_path):
+    src, out = tmp_path / 'src', tmp_path / 'out'
+    _make_tree(src)
+    journal_path = str(out / '.migrate.journal')
+    ifile.migrate(str(src), str(out), num_workers=2)
+    assert sorted(os.listdir(out)) == ['x1.jpg', 'x2.png', 'y1.jpg']
+    # 全部成功后删除日志
+    assert not os.path.exists(journal_path)
+
+    # 中断后重跑: 日志中未变化的文件跳过, 内容变化的文件重新迁移
+    (out / 'x1.jpg').write_bytes(b'stale')
+    (out / 'y1.jpg').write_bytes(b'stale')
+    st = os.stat(src / 'a' / 'x1.jpg')
+    with open(journal_path, 'w') as f:
+        f.write(f"{src / 'a' / 'x1.jpg'}\t{st.st_size}\t{st.st_mtime_ns}\n")
+        f.write(f"{src / 'b' / 'y1.jpg'}\t0\t0\n")
+    ifile.migrate(str(src), str(out), num_workers=2)
+    assert (out / 'x1.jpg').read_bytes() == b'stale'
+    assert (out / 'y1.jpg').read_bytes() == b'b/y1.jpg'
+    assert not os.path.exists(journal_path)
+
+
+def test_list_file_threads(tmp_path):
+    lines = [f"dir_{i % 7}/img_{i}.jpg" for i in range(2000)]
+    res = ifile.gen_list_files(lines, str(tmp_path), is_shuffle=False, is_offsets=True)
+    lf = ifile.ListFile(list(res)[0])
+    assert len(lf) == len(lines) and lf[-1] == lines[-1]
+    # 多线程共享同一个ListFile随机读取
+    idxs = list(range(len(lines)))[::-1] * 4
+    with ThreadPoolExecutor(8) as ex:
+        assert list(ex.map(lf.__getitem__, idxs)) == [lines[i] for i in idxs]
+    lf2 = pickle.loads(pickle.dumps(lf))
+    assert [lf2[i] for i in range(len(lf2))] == lines
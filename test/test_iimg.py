@@ -0,0 +1,43 @@
+import io
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from ibasis import iimg
+
+
+def _jpeg_with_orientation(img, orientation):
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buf = io.BytesIO()
+    Image.fromarray(img[..., ::-1]).save(buf, 'JPEG', exif=exif.tobytes(), quality=95)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize('orientation', range(1, 9))
+def test_decode_orientation(tmp_path, orientation):
+    # 分块图案, 压缩后各backend结果一致
+    img = cv2.resize(np.arange(40 * 3, dtype=np.uint8).reshape(5, 8, 3) * 2, (64, 40),
+                     interpolation=cv2.INTER_NEAREST)
+    buf = _jpeg_with_orientation(img, orientation)
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(buf)
+    ref = cv2.imread(str(path))
+    for reduce in [1, 2]:
+        for backend in ['cv2', 'pil']:
+            assert iimg.decode_img(buf, reduce=reduce, backend=backend).shape == \
+                iimg.decode_img(buf, reduce=reduce, backend='cv2').shape
+    assert np.array_equal(iimg.decode_img(buf, backend='pil'), ref)
+    assert iimg.get_img_size(str(path)) == ref.shape[:2]
+    # turbojpeg 解码后按同样的方向旋转
+    raw = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    assert iimg._scan_jpeg(io.BytesIO(buf))[0] == orientation
+    assert np.array_equal(iimg._apply_orientation(raw, orientation), ref)
+
+
+@pytest.mark.parametrize('backend', ['auto', 'cv2', 'pil'])
+def test_decode_invalid(backend):
+    assert iimg.decode_img(b'', backend=backend) is None
+    assert iimg.decode_img(b'\xff\xd8broken', backend=backend) is None
@@ -0,0 +1,48 @@
+import os
+
+import cv2
+import numpy as np
+
+from ibasis import iimgmeta
+
+
+def _make_tree(root):
+    (root / 'a').mkdir(parents=True)
+    cv2.imwrite(str(root / 'a' / 'x1.jpg'), np.zeros((10, 20, 3), dtype=np.uint8))
+    cv2.imwrite(str(root / 'a' / 'x2.png'), np.zeros((30, 15), dtype=np.uint8))
+    (root / 'bad.jpg').write_bytes(b'bad')
+
+
+def test_build_and_reuse(tmp_path, capsys):
+    tree = tmp_path / 'tree'
+    _make_tree(tree)
+    index_path = str(tmp_path / 'meta.npz')
+    meta = iimgmeta.ImgMetaIndex(str(tree), index_path=index_path).build()
+    assert len(meta) == 3 and os.path.exists(index_path)
+    i = meta.index(str(tree / 'a' / 'x1.jpg'))
+    assert meta.get_meta(i) == {'rel_path': 'a/x1.jpg', 'width': 20, 'height': 10, 'channels': 3,
+                                'format': 'jpeg', 'filesize': os.path.getsize(tree / 'a' / 'x1.jpg')}
+    assert meta.index('a/x2.png') >= 0 and meta.index('nope.jpg') == -1
+    assert meta.get_mask().sum() == 2
+    assert meta.get_mask(min_size=(15, 16)).tolist() == [False, True, False]
+    assert meta.get_mask(formats=['png']).sum() == 1
+
+    # 增量更新: 只重新读取变化的文件
+    cv2.imwrite(str(tree / 'a' / 'x1.jpg'), np.zeros((12, 24, 3), dtype=np.uint8))
+    capsys.readouterr()
+    meta = iimgmeta.ImgMetaIndex(str(tree), index_path=index_path).build()
+    assert 'reuse:2, parse:1' in capsys.readouterr().out
+    assert meta.get_meta(meta.index('a/x1.jpg'))['width'] == 24
+
+
+def test_default_index_path(tmp_path, monkeypatch):
+    tree = tmp_path / 'tree'
+    _make_tree(tree)
+    monkeypatch.setattr(iimgmeta, 'IMG_META_CACHE_DIR', str(tmp_path / 'cache'))
+    meta = iimgmeta.build_img_meta(str(tree))
+    # 索引不写入图片目录
+    assert meta.index_path.startswith(str(tmp_path / 'cache'))
+    assert sorted(os.listdir(tree)) == ['a', 'bad.jpg']
+    # 不可写时只保存在内存中
+    meta = iimgmeta.ImgMetaIndex(str(tree), index_path=str(tree / 'bad.jpg' / 'meta.npz')).build()
+    assert len(meta) == 3
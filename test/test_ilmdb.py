@@ -0,0 +1,134 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from ibasis import ilmdb
+
+
+def _make_pairs(root, num=10, n_bad=0):
+    root.mkdir(parents=True, exist_ok=True)
+    pairs = list()
+    for i in range(num):
+        img_path, lbl_path = root / f"{i}.jpg", root / f"{i}.txt"
+        if i < n_bad:
+            img_path.write_bytes(b'bad')
+        else:
+            cv2.imwrite(str(img_path), np.full((8, 12, 3), i * 10, dtype=np.uint8))
+        lbl_path.write_text(f"lbl{i}")
+        pairs.append((str(i), str(img_path), str(lbl_path)))
+    return pairs
+
+
+def test_writer_commit_and_read(tmp_path):
+    db = ilmdb.LMDB(str(tmp_path / 'db'), map_size=1 << 24, profile='write')
+    # commit_items 很小, 写入期间多次提交
+    with db.writer(batch_size=3, commit_items=5, is_verbose=False) as writer:
+        writer.put_many((f"a-{i:03d}", str(i)) for i in range(20))
+        writer.put('b-000', b'x')
+    assert writer.n_items == 21
+    assert db.get('a-007') == b'7'
+    assert db.get_many(['b-000', 'nope', 'a-000']) == [b'x', None, b'0']
+    assert [k.decode() for k in db.iter_range(prefix='a', start='a-015', values=False)] == \
+        [f"a-{i:03d}" for i in range(15, 20)]
+    assert list(db.get_all(only_key=True, prefix='b')) == ['b-000']
+    assert list(db.get_all(prefix='a', num_workers=4)) == [(f"a-{i:03d}", str(i).encode()) for i in range(20)]
+
+
+def test_writer_append_order(tmp_path):
+    db = ilmdb.LMDB(str(tmp_path / 'db'), map_size=1 << 24)
+    with pytest.raises(ValueError):
+        with db.writer(is_append=True, is_verbose=False) as writer:
+            writer.put_many([('b', '1'), ('a', '2'), ('c', '3')])
+    assert list(db.get_all(only_key=True)) == []
+    with db.writer(is_append=True, is_verbose=False) as writer:
+        writer.put_many([('b', '1'), ('c', '3')])
+    # 不大于库中已有key
+    with pytest.raises(ValueError):
+        with db.writer(is_append=True, is_verbose=False) as writer:
+            writer.put('a', '2')
+    assert list(db.get_all(only_key=True)) == ['b', 'c']
+
+
+def test_build_and_shards(tmp_path):
+    pairs = _make_pairs(tmp_path / 'src', n_bad=1)
+    with pytest.raises(ValueError):
+        ilmdb.build_lmdb(pairs, str(tmp_path / 'x'), is_append=True)
+    assert ilmdb.build_lmdb(pairs, str(tmp_path / 'db'), check_mode='validate', num_workers=2) == 9
+    locr = ilmdb.LMDB_OCR(str(tmp_path / 'db'), profile='read')
+    assert locr.get_num_samples() == 9
+    assert locr.get_lbl('label-000000001') == 'lbl1'
+    assert locr.get_img_arr('image-000000001').shape == (8, 12, 3)
+    del locr
+
+    res = ilmdb.build_lmdb_shards(pairs, str(tmp_path / 'shards'), 3, check_mode='validate')
+    assert [n for _, n in res] == [3, 3, 3]
+    sdb = ilmdb.ShardedLMDB([d for d, _ in res])
+    assert len(sdb) == 9
+    shard, local_idx = sdb.locate(np.array([0, 2, 3, 8]))
+    assert shard.tolist() == [0, 0, 1, 2] and local_idx.tolist() == [0, 2, 0, 2]
+    with pytest.raises(IndexError):
+        sdb.locate(9)
+    # 分片0为pairs[0::3], pairs[0]损坏被跳过, 第1条为pairs[3]
+    img, lbl = sdb[1]
+    assert lbl == 'lbl6' and img.shape == (8, 12, 3)
+
+
+def test_gen_img_lbl_resume(tmp_path):
+    pairs = _make_pairs(tmp_path / 'src', num=6)
+    ilmdb.build_lmdb(pairs, str(tmp_path / 'db'))
+    out_dir = tmp_path / 'out'
+    ilmdb.gen_img_lbl(str(tmp_path / 'db'), str(out_dir), num_workers=2, batch_size=2)
+    names = sorted(os.listdir(out_dir / 'images'))
+    assert names == [f"image-{i:09d}.jpg" for i in range(1, 7)]
+    assert (out_dir / 'labels' / 'labels.txt').read_text().splitlines()[0] == 'image-000000001.jpg,lbl0'
+
+    # 全部成功后删除日志
+    journal_path = out_dir / '.gen_img_lbl.journal'
+    assert not journal_path.exists()
+
+    # 中断后重跑只导出缺失的图片
+    locr = ilmdb.LMDB_OCR(str(tmp_path / 'db'), profile='read')
+    header = f"# {os.path.abspath(tmp_path / 'db')}\t{locr.env.info()['last_txnid']}\n"
+    del locr
+    os.remove(out_dir / 'images' / names[2])
+    journal_path.write_text(header + ''.join(f"{n[:-4]}\n" for i, n in enumerate(names) if i != 2))
+    mtime = os.stat(out_dir / 'images' / names[0]).st_mtime_ns
+    ilmdb.gen_img_lbl(str(tmp_path / 'db'), str(out_dir), num_workers=2, batch_size=2)
+    assert sorted(os.listdir(out_dir / 'images')) == names
+    assert os.stat(out_dir / 'images' / names[0]).st_mtime_ns == mtime
+
+    # 另一个lmdb导出到同一目录时不沿用旧日志
+    pairs2 = _make_pairs(tmp_path / 'src2', num=6)
+    pairs2 = [(k, img_path, pairs[0][2]) for k, img_path, _ in pairs2[::-1]]
+    ilmdb.build_lmdb(pairs2, str(tmp_path / 'db2'))
+    journal_path.write_text(header + ''.join(f"{n[:-4]}\n" for n in names))
+    ilmdb.gen_img_lbl(str(tmp_path / 'db2'), str(out_dir), num_workers=2, batch_size=2)
+    img = cv2.imread(str(out_dir / 'images' / names[0]))
+    assert abs(int(img.mean()) - 50) <= 2
+
+
+@pytest.mark.parametrize('subdir', [True, False])
+def test_stat_and_compact(tmp_path, subdir):
+    path = str(tmp_path / ('db' if subdir else 'db.mdb'))
+    db = ilmdb.LMDB(path, map_size=1 << 24, subdir=subdir)
+    with db.writer(is_verbose=False) as writer:
+        writer.put_many((f"image-{i}", b'x' * 1000) for i in range(50))
+        writer.put('num-samples', '50')
+    assert db.get_prefix_hist() == {'image': 50, 'num': 1}
+    assert db.get_stat()['entries'] == 51
+    out = str(tmp_path / ('out' if subdir else 'out.mdb'))
+    src_size, dst_size = db.compact(out)
+    assert 0 < dst_size <= src_size
+    assert os.path.isdir(out) == subdir
+
+
+def test_validate_imgs(tmp_path):
+    pairs = _make_pairs(tmp_path / 'src', num=4)
+    ilmdb.build_lmdb(pairs, str(tmp_path / 'db'))
+    locr = ilmdb.LMDB_OCR(str(tmp_path / 'db'))
+    with locr.writer(is_verbose=False) as writer:
+        writer.put('image-000000002', b'')
+        writer.put('image-000000003', b'\xff\xd8broken')
+    assert locr.validate_imgs(num_workers=2) == ['image-000000002', 'image-000000003']
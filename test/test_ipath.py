@@ -0,0 +1,95 @@
+import os
+import os.path as osp
+import warnings
+
+import pytest
+
+from ibasis import ipath
+
+
+def _get_paths_walk(dir_, file_type=None, key_mode=0, stem_append=None, is_rel=False):
+    """基于os.walk的原始实现, 作为get_paths的对照"""
+    def rm_stem_append(x):
+        return x.replace(stem_append, '') if stem_append is not None else x
+
+    if isinstance(file_type, str):
+        file_type = ['.png', '.jpg', '.jpeg'] if file_type == 'IMAGE' else [file_type]
+    path_dic = dict()
+    for root, _, names in os.walk(dir_):
+        for name in names:
+            stem, suffix = osp.splitext(name)
+            if file_type is not None and suffix.lower() not in file_type:
+                continue
+            abs_path = osp.join(root, name)
+            rel_path = osp.relpath(abs_path, dir_)
+            if key_mode in [0, 1]:
+                key = rm_stem_append(stem) if key_mode == 0 else name
+            elif key_mode in [2, 3]:
+                key = rm_stem_append(osp.splitext(rel_path)[0]) if key_mode == 2 else rel_path
+            else:
+                key = '/'.join(rel_path.split('/')[-2:])
+                if key_mode == 4:
+                    key = rm_stem_append(osp.splitext(key)[0])
+            path_dic[key] = rel_path if is_rel else abs_path
+    return path_dic
+
+
+def _make_tree(root):
+    rels = ['top.jpg', 'top.lines.jpg', 'a/x1.jpg', 'a/x2.PNG', 'a/n.txt', 'a/b/x3.jpeg', 'a/b/c/x4.jpg',
+            'c/y1.jpg', 'c/.hidden.jpg', 'd/e/f/g.png', 'empty/']
+    for rel in rels:
+        path = root / rel
+        if rel.endswith('/'):
+            path.mkdir(parents=True, exist_ok=True)
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'0')
+
+
+@pytest.mark.parametrize('key_mode', [0, 1, 2, 3, 4, 5])
+@pytest.mark.parametrize('file_type', [None, 'IMAGE', '.txt'])
+@pytest.mark.parametrize('is_rel', [False, True])
+def test_get_paths_matches_walk(tmp_path, key_mode, file_type, is_rel):
+    tree = tmp_path / 'tree'
+    _make_tree(tree)
+    kw = dict(file_type=file_type, key_mode=key_mode, stem_append='.lines', is_rel=is_rel)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        ref = _get_paths_walk(str(tree), **kw)
+        for num_workers in [1, 4]:
+            assert ipath.get_paths(str(tree), num_workers=num_workers, **kw) == ref
+        cache_dir = str(tmp_path / 'cache')
+        assert ipath.get_paths(str(tree), cache_dir=cache_dir, **kw) == ref
+        # 命中缓存
+        assert ipath.get_paths(str(tree), cache_dir=cache_dir, **kw) == ref
+        res = ipath.get_paths(str(tree), is_sort=True, is_lis=True, **kw)
+    assert res == [ref[k] for k in sorted(ref)]
+
+
+def test_get_dirs_and_early_stop(tmp_path):
+    tree = tmp_path / 'tree'
+    _make_tree(tree)
+    assert sorted(ipath.get_dirs(str(tree), max_level=1)) == \
+        sorted(str(tree / d) for d in ['a', 'c', 'd', 'empty'])
+    assert sorted(ipath.get_dirs(str(tree), max_level=2)) == \
+        sorted(str(tree / d) for d in ['a/b', 'c', 'd/e', 'empty'])
+    # 提前结束迭代时线程池正常退出
+    it = ipath.iter_paths(str(tree), num_workers=4)
+    next(it)
+    it.close()
+
+
+@pytest.mark.parametrize('is_sort', [True, False])
+def test_get_dataset_pair_order(tmp_path, is_sort):
+    for name in ['b', 'c', 'a', 'd']:
+        (tmp_path / 'img').mkdir(exist_ok=True)
+        (tmp_path / 'img' / f"{name}.jpg").touch()
+    for name in ['a', 'b', 'c']:
+        (tmp_path / 'lbl').mkdir(exist_ok=True)
+        (tmp_path / 'lbl' / f"{name}.json").touch()
+    img_dir, lbl_dir = str(tmp_path / 'img'), str(tmp_path / 'lbl')
+    pairs = ipath.get_dataset_pair(img_dir, lbl_dir, is_sort=is_sort, is_lis=True)
+    img_keys = list(ipath.get_paths(img_dir))
+    keys = sorted(img_keys) if is_sort else img_keys
+    assert [p[0] for p in pairs] == [k for k in keys if k != 'd']
+    assert pairs[0][1:] == [osp.join(img_dir, f"{pairs[0][0]}.jpg"), osp.join(lbl_dir, f"{pairs[0][0]}.json")]
@@ -0,0 +1,58 @@
+import pickle
+
+import pytest
+
+from ibasis import ipath
+from ibasis.ipathtable import PathTable, pair_tables
+
+
+def _make_tree(root):
+    for rel in ['a/x1.jpg', 'a/x2.png', 'a/b/x3.jpg', 'c/y1.jpg', '.hidden', 'top.jpg']:
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'0')
+
+
+@pytest.mark.parametrize('is_rel', [False, True])
+@pytest.mark.parametrize('key_mode', [0, 2, 3])
+def test_from_dir_cache_matches_walk(tmp_path, is_rel, key_mode):
+    tree = tmp_path / 'tree'
+    _make_tree(tree)
+    kw = dict(key_mode=key_mode, is_rel=is_rel)
+    table = PathTable.from_dir(str(tree), **kw)
+    cached = PathTable.from_dir(str(tree), cache_dir=str(tmp_path / 'cache'), **kw)
+    # 第二次读取命中缓存
+    cached2 = PathTable.from_dir(str(tree), cache_dir=str(tmp_path / 'cache'), **kw)
+    assert dict(table.items()) == dict(cached.items()) == dict(cached2.items())
+    assert dict(table.items()) == ipath.get_paths(str(tree), key_mode=key_mode, is_rel=is_rel)
+
+
+def test_lookup_and_pickle(tmp_path):
+    tree = tmp_path / 'tree'
+    _make_tree(tree)
+    table = PathTable.from_dir(str(tree), key_mode=3)
+    assert table.index('a/b/x3.jpg') >= 0 and table.index('nope') == -1
+    assert table['c/y1.jpg'] == str(tree / 'c' / 'y1.jpg')
+    assert dict(pickle.loads(pickle.dumps(table)).items()) == dict(table.items())
+
+
+def test_pair_index():
+    img = {'a': '/i/a.jpg', 'b': '/i/b.jpg', 'c': '/i/c.jpg'}
+    lbl = {'b': '/l/b.json', 'c': '/l/c.json', 'd': '/l/d.json'}
+    pair = pair_tables(img, lbl, is_verbose=False)
+    assert list(pair) == [('b', '/i/b.jpg', '/l/b.json'), ('c', '/i/c.jpg', '/l/c.json')]
+    assert pair.index('c') == 1 and pair.index('a') == -1 and pair.index('d') == -1
+    assert pair.only_img_keys() == ['a'] and pair.only_lbl_keys() == ['d']
+
+
+def test_pair_backends_match():
+    img = {f"d{i % 5}/k{i}": f"/i/d{i % 5}/k{i}.jpg" for i in range(0, 300, 2)}
+    lbl = {f"d{i % 5}/k{i}": f"/l/d{i % 5}/k{i}.json" for i in range(0, 300, 3)}
+    ref = [(k, img[k], lbl[k]) for k in sorted(img.keys() & lbl.keys())]
+    img_table, lbl_table = PathTable.from_dict(img, '/i'), PathTable.from_dict(lbl, '/l')
+    for img_map, lbl_map in [(img, lbl), (img_table, lbl_table), (img, lbl_table), (img_table, lbl)]:
+        pair = pair_tables(img_map, lbl_map, is_verbose=False)
+        assert list(pair) == ref
+        assert sorted(pair.only_img_keys()) == sorted(img.keys() - lbl.keys())
+        assert sorted(pair.only_lbl_keys()) == sorted(lbl.keys() - img.keys())
+        assert pair.index(ref[3][0]) == 3